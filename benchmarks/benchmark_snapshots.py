@@ -0,0 +1,100 @@
+'''
+Measures the per-run walk of the source folder by new_folders and
+modified_folders modes: walking alone, listing modifications against the
+previous snapshot (walk, diff and snapshot write) and updating the snapshot
+of a few project folders changed by a run.
+
+Run with $ python benchmarks/benchmark_snapshots.py
+'''
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+repo_folder = Path(__file__).parents[1]
+sys.path.append(str(repo_folder / "photo_backuper"))
+
+from photo_backuper import backuper as backuper_module
+from photo_backuper.backuper import Backuper
+
+
+def create_tree(root_folder, projects, files):
+    """Creates project folders with small files in the source folder.
+
+    Args:
+        root_folder (pathlib.Path): Absolute path to root folder
+        projects (int): Number of project folders
+        files (int): Number of files per project folder
+    Returns:
+        list of project folder paths relative to root folder
+    """
+    project_folders = []
+    for i in range(projects):
+        project_folder = Path(f"Location {i % 10}", f"2023.{i:04} Project")
+        for j in range(files):
+            path = root_folder / project_folder / ("fb" if j % 2 else "tiffs") / f"P{j:05}.jpg"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"0")
+        project_folders.append(project_folder)
+    return project_folders
+
+
+def measure(function, repeat):
+    """Returns median duration (s) of calls of the function and peak of memory
+    (bytes) allocated by another call traced separately (tracing slows it down).
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(durations), peak
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as folder:
+        root_folder = Path(folder)
+        Backuper("initialize", root_folder).mode_initialize_settings()
+        project_folders = create_tree(root_folder, args.projects, args.files)
+        backuper = Backuper("new_folders", root_folder, root_folder, root_folder)
+        backuper.autogen_modifications() # first snapshot
+        changed = project_folders[::max(1, len(project_folders) // args.changed)][:args.changed]
+        for project_folder in changed:
+            os.remove(next((root_folder / project_folder / "fb").iterdir()))
+
+        snapshot_path = backuper.autogen_folder / Backuper.FILENAME_TREE_SNAPSHOT
+        cases = {
+            "walk": lambda: sum(1 for _ in backuper_module._walk_project_files(root_folder)),
+            "list modifications": backuper.autogen_modifications,
+            f"update {len(changed)} projects": lambda: backuper._update_tree_snapshot(changed),
+        }
+        n = args.projects * args.files
+        print(f"{n} files in {args.projects} project folders, "
+              f"snapshot {snapshot_path.stat().st_size / 1024:.0f} kB:")
+        for name, function in cases.items():
+            duration, peak = measure(function, args.repeat)
+            print(f"  {name:<20} {duration * 1000:8.1f} ms {duration / n * 1e6:6.2f} us/file "
+                  f"{peak / 1024:8.0f} kB peak")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=200, help="Number of project folders.")
+    parser.add_argument("--files", type=int, default=100, help="Number of files per project folder.")
+    parser.add_argument("--changed", type=int, default=5, help="Number of project folders changed by a run.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per case.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
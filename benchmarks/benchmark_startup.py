@@ -0,0 +1,100 @@
+'''
+Measures cold start of the CLI and the web app and per file cost of logging
+and metrics of file operations.
+
+Run with $ python benchmarks/benchmark_startup.py
+'''
+
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+repo_folder = Path(__file__).parents[1]
+sys.path.append(str(repo_folder / "photo_backuper"))
+sys.path.append(str(repo_folder / "photo_backuper_app"))
+
+from photo_backuper.backuper import Backuper
+from metrics import Metrics
+
+COLD_START_SNIPPETS = {
+    "import backuper": "import photo_backuper.backuper",
+    "import app": "import app",
+    "create app": "import app; app.create_app()",
+    "first request": ("import app, tempfile, os; "
+                      "db = os.path.join(tempfile.mkdtemp(), 'logs.db'); "
+                      "app.create_app({'DATABASE': db, 'WTF_CSRF_ENABLED': False})"
+                      ".test_client().get('/')"),
+}
+
+
+def measure_cold_start(snippet, repeat):
+    """Returns median duration (s) of a fresh Python process running the snippet.
+    """
+    paths = [str(repo_folder / "photo_backuper"), str(repo_folder / "photo_backuper_app")]
+    code = f"import sys; sys.path[:0] = {paths!r}; {snippet}"
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def measure_file_operation(level, callback, count):
+    """Returns mean duration (s) of reporting a single file operation.
+
+    Args:
+        level (int): Logging level of the root logger.
+        callback (callable): file_operation_callback of the backuper (or None).
+        count (int): Number of reported operations.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        root_folder = Path(folder)
+        path = root_folder / "2023" / "2023_01_01_Project" / "photo.jpg"
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"0" * 1024)
+
+        logging.getLogger().setLevel(level)
+        backuper = Backuper("initialize", root_folder, file_operation_callback=callback)
+        start = time.perf_counter()
+        for _ in range(count):
+            backuper._record_file_operation("copy", path, root_folder, time.perf_counter())
+        return (time.perf_counter() - start) / count
+
+
+def main(args):
+    print("Cold start (median of fresh processes):")
+    for name, snippet in COLD_START_SNIPPETS.items():
+        duration = measure_cold_start(snippet, args.repeat)
+        print(f"  {name:<16} {duration * 1000:8.1f} ms")
+
+    # log records are formatted but discarded, to measure logging itself rather than the terminal
+    logging.basicConfig(stream=open(os.devnull, "w"), level=logging.WARNING)
+    cases = {
+        "no reporting": (logging.INFO, None),
+        "callback": (logging.INFO, lambda *args: None),
+        "metrics": (logging.INFO, Metrics()),
+        "debug log": (logging.DEBUG, None),
+    }
+    print(f"Per file operation (mean of {args.count}):")
+    for name, (level, callback) in cases.items():
+        duration = measure_file_operation(level, callback, args.count)
+        print(f"  {name:<16} {duration * 1e6:8.2f} us")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="Number of processes per cold start case.")
+    parser.add_argument("--count", type=int, default=10000, help="Number of file operations per case.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
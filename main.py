@@ -4,8 +4,6 @@ import logging
 
 from photo_backuper.backuper import Backuper
 
-logging.basicConfig(level=logging.DEBUG)
-
 
 def main(args):
 
@@ -23,7 +21,15 @@ def main(args):
         backuper = Backuper(mode=args.mode,
                             utility_root=args.utility_root,
                             source_folder=args.source_folder,
-                            target_folder=args.target_folder)
+                            target_folder=args.target_folder,
+                            placement_policy=args.placement_policy,
+                            pc_budget=args.pc_budget,
+                            scrub_days=args.scrub_days,
+                            scrub_rate_limit=args.scrub_rate_limit,
+                            container_mode=args.container_mode,
+                            container_compression=args.container_compression,
+                            scan_workers=args.scan_workers,
+                            verify_workers=args.verify_workers)
 
     backuper.perform_current_mode()
 
@@ -34,11 +40,31 @@ def parse_args():
     parser.add_argument("--utility_root", type=str, required=True, help=("Absolute path to " 
                         "folder containing utility folder (typically on a desktop or a laptop)."))
     parser.add_argument("--source_folder", type=str, help="Absolute path to origin folder.")
-    parser.add_argument("--target_folder", type=str, help="Absolute path to destination folder.")
+    parser.add_argument("--target_folder", type=str, nargs="+", help=("Absolute path to destination "
+                        "folder. Several paths can be given to use a pool of drives."))
+    parser.add_argument("--placement_policy", type=str, choices=Backuper.PLACEMENT_POLICIES,
+                        default="most_free", help="Policy to place new project folders in a pool of drives.")
+    parser.add_argument("--pc_budget", type=lambda x: int(float(x) * 1024**3), help=("Storage "
+                        "budget for raw data on PC in GB (pc_budget mode)."))
+    parser.add_argument("--scrub_days", type=int, default=30, help=("Number of scrub mode runs "
+                        "to check the whole target folder in."))
+    parser.add_argument("--scrub_rate_limit", type=lambda x: int(float(x) * 1024**2), help=("Maximum "
+                        "hashing rate in scrub mode in MB/s (unlimited by default)."))
+    parser.add_argument("--container_mode", default=False, action='store_true', help=("Pack small "
+                        "copied files into a single container per project folder (for network drives)."))
+    parser.add_argument("--container_compression", type=str, choices=Backuper.CONTAINER_COMPRESSIONS,
+                        help="Compression of containers (none by default).")
+    parser.add_argument("--scan_workers", type=int, default=1, help=("Number of processes "
+                        "scanning files (modified_folders and scrub modes)."))
+    parser.add_argument("--verify_workers", type=int, default=1, help=("Number of processes "
+                        "hashing files (scrub mode)."))
     parser.add_argument("--demo", default=False, action='store_true', help="Demo mode on made up data.")
+    parser.add_argument("--log_level", type=str, default="INFO", choices=["DEBUG", "INFO", "WARNING"],
+                        help="Logging level. DEBUG logs every file operation.")
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_args()
+    logging.basicConfig(level=args.log_level)
     main(args)
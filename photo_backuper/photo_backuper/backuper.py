@@ -2,10 +2,22 @@ from pathlib import Path
 import os
 import shutil
 import logging
+import time
+import hashlib
+import uuid
+import tarfile
+import mmap
+import struct
+from array import array
+from collections import deque
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, closing
+from datetime import datetime
 
 from send2trash import send2trash
 
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 
 class Backuper:
@@ -30,23 +42,68 @@ class Backuper:
         new_folders -- Backs up all project folders not present on the target
           (i.e. destination) device. Raw files and folders specified in settings are
           moved to the target, rest of contents is copied.
-        modified_folders -- Backs up project folders modified in one root folder,
-          deleting any superabundant files on the target and backing up the rest as
-          in new_folders mode. These project folders must be specified in a settings
-          file and are removed from it automatically after the backup.
+        modified_folders -- Reconciles project folders modified on PC or HDD,
+          propagating changes (including deletions) of each file from the side
+          it changed on since the last sync, raw data are kept on HDD. These project
+          folders must be specified in settings files and are removed from them
+          automatically after the backup.
+        pc_budget -- Keeps raw data on PC within a storage budget. Raw data of
+          least recently used project folders are evicted to the target (once
+          verified there), raw data of project folders to be processed are restored
+          from the target. Project folders keeping raw data on PC are written to
+          the settings file instead of being maintained by hand.
+        scrub -- Re-hashes a slice of files in the target folder against stored
+          checksums, resuming where the last run stopped, so that the whole target
+          folder is checked over scrub_days runs. Corrupt or missing files are
+          reported to .autogen folder and copied again from source folder where
+          a good copy still exists.
 
     Args:
         mode (str): Mode to run the program in.
         utility_root (str): Absolute path to root folder that shall contain
           the utility folder.
         source_folder (str): Absolute path to source folder (currently only master PC)
-        target_folder (str): Absolute path to target folder (currently only master HDD)
+        target_folder (str or list): Absolute path to target folder (currently only
+          master HDD), or a list of absolute paths to target folders on several drives
+          (a pool of drives). New project folders are then placed on the drives
+          according to placement_policy and their location is kept in a location index.
+        placement_policy (str): Policy to choose a drive from the pool of target
+          folders for a new project folder. One of PLACEMENT_POLICIES:
+          "most_free" -- drive with the most free space (balances the drives),
+          "fill_first" -- first drive in the pool with enough free space.
+        pc_budget (int): Storage budget for raw data on PC in bytes. Required
+          for pc_budget mode.
+        scrub_days (int): Number of scrub mode runs to check the whole target folder in.
+        scrub_rate_limit (int): Maximum hashing rate in scrub mode in bytes per second.
+          Unlimited if None.
+        scan_workers (int): Number of processes scanning files of project folders
+          (in modified_folders and scrub modes). Work is split into tasks of a few
+          project folders. Scanned in the current process if 1.
+        verify_workers (int): Number of processes hashing files in scrub mode. Work is
+          sharded by location folder and scrub_rate_limit is split among the processes.
+          Hashed in the current process if 1.
+        container_mode (bool): If True, small files copied to the target (such as
+          exported JPEGs in selection folders) are packed into a single tar container
+          per project folder with an index file, to avoid per-file latency of network
+          drives. Raw data and files larger than CONTAINER_MAX_FILE_SIZE are still
+          moved or copied as plain files.
+        container_compression (str): Optional compression of containers. One of
+          CONTAINER_COMPRESSIONS ("gz", "bz2", "xz"), None for no compression (allowing
+          restore of single files without reading the whole container).
+        file_operation_callback (callable): Optional. Called after each file operation
+          (copy, move, delete, scan, ...) performed on project folders with arguments
+          operation (str), device (str, absolute path to root folder the operation was
+          performed in), project folder and file path relative to root folder (str
+          in posix format), size in bytes (int) and duration in seconds (float).
+          Failed operations are reported as ERROR_OPERATIONS.
     """
 
     PROGRAM_NAME = "photo_backuper"
-    MODES = ["initialize", "new_folders", "modified_folders"]
+    ERROR_OPERATIONS = ["error", "corrupt", "missing"]
+    MODES = ["initialize", "new_folders", "modified_folders", "pc_budget", "scrub"]
     MODES_NAMES = ["Initialize", "Backup New Folders",
-                   "Backup Modified Folders"]
+                   "Backup Modified Folders", "Manage PC Storage Budget",
+                   "Scrub Target Archive"]
     
     # utility folder settings
     EXAMPLE_LINE = ( # TODO: prefer relative path
@@ -55,9 +112,40 @@ class Backuper:
     )
     FILENAME_PROJECTS_MODIFIED_PC = "project_folders_modified_pc.txt"
     FILENAME_PROJECTS_MODIFIED_HDD = "project_folders_modified_hdd.txt"
+    FILENAME_PROJECTS_WITH_RAW = "project_folders_with_raw_on_pc.txt"
+    FILENAME_PROJECTS_TO_BE_PROCESSED = "project_folders_to_be_processed.txt"
+    FILENAME_LOCATION_INDEX = "project_folders_location_index.txt"
+    FILENAME_DRIVE_ID = "drive_id.txt"
+    FILENAME_ACCESS_TIMES = "project_folders_access_times.txt"
+    FILENAME_CHECKSUMS = "target_checksums.bin"
+    FILENAME_SYNC_SNAPSHOT = "sync_snapshot.bin"
+    FILENAME_SYNC_CONFLICTS = "sync_conflicts.txt"
+    FILENAME_SCRUB_PROGRESS = "scrub_progress.txt"
+    FILENAME_SCRUB_REPORT = "scrub_report.txt"
+    FILENAME_MODIFICATIONS = "project_folders_list_modifications.txt"
+    FILENAME_TREE_SNAPSHOT = "source_snapshot.bin"
+
+    # target drives pool settings
+    PLACEMENT_POLICIES = ["most_free", "fill_first"]
+    FREE_SPACE_RESERVE = 1024**3 # bytes kept free on every target drive
+
+    # scrub settings
+    HASH_CHUNK_SIZE = 1024**2
+    SCAN_TASK_FOLDERS = 8 # project folders scanned by a single task of a worker process
+    VERIFY_TASK_FILES = 64 # files hashed by a single task of a worker process
+    VERIFY_BATCH_FILES = 1024 # files of scrub mode hashed at once (bounds memory)
+
+    # container mode settings
+    CONTAINER_NAME = "_small_files.tar"
+    CONTAINER_INDEX_NAME = "_small_files.index.txt"
+    CONTAINER_COMPRESSIONS = ["gz", "bz2", "xz"]
+    CONTAINER_MAX_FILE_SIZE = 16 * 1024**2
 
     def __init__(self, mode, utility_root, source_folder=None,
-                 target_folder=None):
+                 target_folder=None, placement_policy="most_free", pc_budget=None,
+                 scrub_days=30, scrub_rate_limit=None, container_mode=False,
+                 container_compression=None, file_operation_callback=None,
+                 scan_workers=1, verify_workers=1):
         self.mode = mode
         self.utility_root = Path(utility_root)
         self.utility_folder = self.utility_root / ("_" + self.PROGRAM_NAME)
@@ -65,6 +153,19 @@ class Backuper:
         self.utility_folder_exists = self.utility_folder.exists()
         self.source_folder = source_folder # TODO: for now it is master PC
         self.target_folder = target_folder # TODO: for now it is master HDD
+        self.placement_policy = placement_policy
+        self.pc_budget = pc_budget
+        self.scrub_days = scrub_days
+        self.scrub_rate_limit = scrub_rate_limit
+        self.container_mode = container_mode
+        self.container_compression = container_compression
+        self.file_operation_callback = file_operation_callback
+        self.scan_workers = scan_workers
+        self.verify_workers = verify_workers
+        self.queue_depth = 0 # project folders left to process by the running mode
+        self._location_index = None
+        self._drive_roots = None
+        self._checksum_updates = {} # see _flush_checksums
 
     @property
     def mode(self):
@@ -89,11 +190,88 @@ class Backuper:
 
     @property
     def target_folder(self):
-        return self._target_folder
+        """Absolute path to the primary target folder (first one in the pool)
+        """
+        if not self._target_folders:
+            return None
+        return self._target_folders[0]
 
     @target_folder.setter
-    def target_folder(self, root):
-        self._target_folder = self._setter_root_folder(root, "target")
+    def target_folder(self, roots):
+        if not isinstance(roots, (list, tuple)):
+            roots = [roots]
+        target_folders = [self._setter_root_folder(root, "target") for root in roots]
+        self._target_folders = [root for root in target_folders if root]
+        self._location_index = None
+        self._drive_roots = None
+
+    @property
+    def target_folders(self):
+        """List of absolute paths to target folders (pool of target drives)
+        """
+        return self._target_folders
+
+    @property
+    def placement_policy(self):
+        return self._placement_policy
+
+    @placement_policy.setter
+    def placement_policy(self, policy):
+        if policy in self.PLACEMENT_POLICIES:
+            self._placement_policy = policy
+        else:
+            raise ValueError("Placement policy is not in available policies.")
+
+    @property
+    def pc_budget(self):
+        return self._pc_budget
+
+    @pc_budget.setter
+    def pc_budget(self, budget):
+        if budget is not None and budget < 0:
+            raise ValueError("PC budget must not be negative.")
+        self._pc_budget = budget
+
+    @property
+    def scrub_days(self):
+        return self._scrub_days
+
+    @scrub_days.setter
+    def scrub_days(self, days):
+        if days < 1:
+            raise ValueError("Scrub days must be at least 1.")
+        self._scrub_days = days
+
+    @property
+    def scan_workers(self):
+        return self._scan_workers
+
+    @scan_workers.setter
+    def scan_workers(self, workers):
+        if workers < 1:
+            raise ValueError("Number of scan workers must be at least 1.")
+        self._scan_workers = workers
+
+    @property
+    def verify_workers(self):
+        return self._verify_workers
+
+    @verify_workers.setter
+    def verify_workers(self, workers):
+        if workers < 1:
+            raise ValueError("Number of verify workers must be at least 1.")
+        self._verify_workers = workers
+
+    @property
+    def container_compression(self):
+        return self._container_compression
+
+    @container_compression.setter
+    def container_compression(self, compression):
+        if compression is None or compression in self.CONTAINER_COMPRESSIONS:
+            self._container_compression = compression
+        else:
+            raise ValueError("Container compression is not in available compressions.")
 
     # ------ MODES ------
     def perform_current_mode(self):
@@ -102,11 +280,15 @@ class Backuper:
         match self.mode:
             case "initialize":
                 message = self.mode_initialize_settings()
-                logging.info(message)
+                logger.info(message)
             case "new_folders":
                 self.mode_backup_new_folders()
             case "modified_folders":
                 self.mode_backup_modified_folders()
+            case "pc_budget":
+                self.mode_manage_pc_budget()
+            case "scrub":
+                self.mode_scrub_target()
 
     def mode_initialize_settings(self):
         """Performs initialization mode.
@@ -133,10 +315,10 @@ class Backuper:
         in utility folder.
         """
         for message in self.generator_backup_new_folders():
-            logging.info(message)
-        logging.info("Autogenerating lists of project folders with raw files...")
+            logger.info(message)
+        logger.info("Autogenerating lists of project folders with raw files...")
         self.autogen_project_folders_with_raw()
-        logging.info("Backing up finished successfully.")
+        logger.info("Backing up finished successfully.")
 
     def mode_backup_modified_folders(self):
         """Performs modified_folders mode.
@@ -148,17 +330,43 @@ class Backuper:
         in utility folder.
         """
         for message in self.generator_backup_modified_folders():
-            logging.info(message)
-        logging.info("Autogenerating lists of project folders with raw files...")
+            logger.info(message)
+        logger.info("Autogenerating lists of project folders with raw files...")
         self.autogen_project_folders_with_raw()
-        logging.info("Backing up finished successfully.")
+        logger.info("Backing up finished successfully.")
+
+    def mode_manage_pc_budget(self):
+        """Performs pc_budget mode.
+
+        Restores raw data of project folders to be processed from target folder,
+        then evicts raw data of least recently used project folders from source
+        folder until the raw data on PC fit into the budget. Project folders
+        keeping raw data on PC are written to the settings file.
+        """
+        for message in self.generator_manage_pc_budget():
+            logger.info(message)
+        logger.info("Managing PC storage budget finished successfully.")
+
+    def mode_scrub_target(self):
+        """Performs scrub mode.
+
+        Re-hashes a slice of files in the target folder against stored checksums,
+        continuing where the last run stopped. Corrupt or missing files are reported
+        to .autogen folder in utility folder and copied again from source folder
+        where a good copy exists.
+        """
+        for message in self.generator_scrub_target():
+            logger.info(message)
+        logger.info("Scrubbing finished successfully.")
 
     # ------ PUBLIC METHODS ------
 
     def generator_backup_new_folders(self):
         """Generator that backs up new folders while yielding progress messages.
         
-        Also backs up the utility folder.
+        Also backs up the utility folder. Modifications on PC since the last run
+        are listed first (see autogen_modifications), backed up project folders
+        are removed from the list afterwards.
 
         Yields:
         A string with progess message. That is usually number of project folder
@@ -168,30 +376,58 @@ class Backuper:
         self._read_settings()
 
         # backup utility folder
-        utility_target = self.target_folder / self.utility_folder.name
-        shutil.copytree(self.utility_folder, utility_target, dirs_exist_ok=True)
+        self._backup_utility_folder()
+        self.autogen_modifications()
         yield f"Utility folder from {self.source_folder} backed up."
 
         # backup project folders
         source_project_folders = self._get_project_folders(self.source_folder)
-        target_project_folders = self._get_project_folders(self.target_folder)
+        target_project_folders = self._get_target_project_folders()
         new_project_folders = self._compare_project_folders(
             source_project_folders, target_project_folders)
         n = len(new_project_folders)
         if n == 0:
             yield f"No new project folders found in {self.source_folder}."
             return None
-        for i, project_folder in enumerate(new_project_folders):
-            progress_msg = f"Backing up new folder {i+1:3}/{n}: {project_folder}"
-            yield progress_msg
+        backed_up = []
+        with self._tree_snapshot_updated(backed_up, backed_up), self._checksums_flushed():
+            for i, project_folder in enumerate(new_project_folders):
+                self.queue_depth = n - i
+                target_root = self._place_project_folder(project_folder)
+                if target_root is None:
+                    yield (f"Skipping new folder {i+1:3}/{n}: {project_folder} "
+                           "(not enough free space on any target drive)")
+                    continue
+                progress_msg = f"Backing up new folder {i+1:3}/{n}: {project_folder}"
+                if len(self.target_folders) > 1:
+                    progress_msg += f" -> {target_root}"
+                yield progress_msg
 
-            move_raw = project_folder not in self.projects_with_raw
-            self._backup_project_folder(project_folder, move_raw=move_raw)
+                move_raw = project_folder not in self.projects_with_raw
+                self._backup_project_folder(project_folder, move_raw=move_raw,
+                                            target=target_root / project_folder)
+                self._update_location_index(project_folder, target_root)
+                backed_up.append(project_folder)
+            self.queue_depth = 0
 
     def generator_backup_modified_folders(self):
         """Generator that backs up modified folders while yielding progress messages.
         
-        Backs up folders modified on PC, then on HDD. Also backs up the utility folder.
+        Reconciles project folders modified on PC and on HDD in a single pass.
+        Both root folders are scanned once and state of each file (size and
+        modification time) is compared to its state on both sides after the last
+        sync (sync snapshot). Project folders are scanned, planned and reconciled
+        one by one, so that memory does not depend on their number. Changes are propagated from the changed side,
+        while raw data always stay on or go to the HDD. Files changed on both
+        sides differently are reported as conflicts and left untouched. Project
+        folders never synced before are mirrored from the side they are listed
+        for. Containers (see container_mode) on HDD are unpacked into plain files
+        first and small files are packed again afterwards in container mode (the
+        sync snapshot keeps states of the plain files). Project folders synced
+        before with modifications on PC since the last run (see
+        autogen_modifications) are reconciled as if listed for PC and removed from
+        the list. Also backs
+        up the utility folder.
 
         Yields:
         A string with progess message. That is usually number of project folder
@@ -201,28 +437,337 @@ class Backuper:
         self._read_settings()
 
         # backup utility folder
-        utility_target = self.target_folder / self.utility_folder.name
-        shutil.copytree(self.utility_folder, utility_target, dirs_exist_ok=True)
+        self._backup_utility_folder()
+        self.autogen_modifications()
 
-        # backup modified project folders
+        # modified project folders, including synced ones listed by autogen_modifications
+        # (project folders never synced are mirrored from the side they are listed for)
         projects_modified_pc = set(self._read_project_folders_list(
             self.FILENAME_PROJECTS_MODIFIED_PC, self.source_folder))
+        backed_up = set(self._get_target_project_folders())
+        projects_modified_pc.update(self._get_synced_project_folders(
+            project_folder for project_folder in self._read_modifications()
+            if project_folder in backed_up and self._is_connected(project_folder)))
         projects_modified_hdd = set(self._read_project_folders_list(
             self.FILENAME_PROJECTS_MODIFIED_HDD, self.target_folder))
-        # ignore folders incorrectly listed on both lists
-        intersection = projects_modified_pc & projects_modified_hdd
+        # in order of their records in sync snapshot (see _open_sync_snapshot)
+        project_folders = sorted(projects_modified_pc | projects_modified_hdd,
+                                 key=lambda project_folder: project_folder.as_posix() + "/")
+        n = len(project_folders)
+        if n == 0:
+            yield "No modified project folders found."
+            return None
 
-        projects_modified_pc = list(projects_modified_pc - intersection)
-        for msg in self._subgenerator_modified_folders(
-            projects_modified_pc, self.source_folder, self.target_folder):
-            yield msg
-        
-        # TODO bug: with source and target swapped, the method moves RAW files
-        # to PC instead of keeping it in HDD
-        projects_modified_hdd = list(projects_modified_hdd - intersection)
-        for msg in self._subgenerator_modified_folders(
-            projects_modified_hdd, self.target_folder, self.source_folder):
-            yield msg
+        # project folders are scanned, planned and reconciled one by one, while sync
+        # snapshot is rewritten in a single streaming pass (see _open_sync_snapshot)
+        def root_project_folders():
+            for project_folder in project_folders:
+                hdd_root = self._resolve_root(self.target_folder, project_folder)
+                self._unpack_containers(hdd_root / project_folder)
+                yield self.source_folder, project_folder
+                yield hdd_root, project_folder
+
+        conflicts = []
+        reconciled, synced = [], [] # synced are reconciled without conflicts
+        with (self._tree_snapshot_updated(reconciled, synced),
+              self._open_sync_snapshot() as sync_snapshot, self._checksums_flushed(),
+              closing(_RecordsCursor(self._read_checksums())) as stored_checksums,
+              closing(self._scan_project_folders(root_project_folders())) as scans):
+            for i, project_folder in enumerate(project_folders):
+                self.queue_depth = n - i
+                (pc_root, _), pc_files = next(scans)
+                (hdd_root, _), hdd_files = next(scans)
+                if project_folder in projects_modified_pc and project_folder in projects_modified_hdd:
+                    listed_side = None
+                elif project_folder in projects_modified_pc:
+                    listed_side = "pc"
+                else:
+                    listed_side = "hdd"
+                move_raw = project_folder not in self.projects_with_raw
+                snapshot = sync_snapshot.take_project(project_folder)
+                plan = self._plan_reconciliation(project_folder, pc_files, hdd_files, snapshot,
+                                                 listed_side, move_raw)
+                yield (f"Backing up modified folder {i+1:2}/{n}: {project_folder} "
+                       f"({len(plan)} actions)")
+                project_conflicts = [path for action, path in plan if action == "conflict"]
+                for path in project_conflicts:
+                    yield f"Conflict (changed on both PC and HDD): {path}"
+                conflicts += project_conflicts
+                self._apply_reconciliation(plan, pc_root, hdd_root)
+                reconciled.append(project_folder)
+
+                # store synced state
+                pc_files = self._scan_files(pc_root, project_folder)
+                hdd_files = self._scan_files(hdd_root, project_folder)
+                for path in sorted(set(pc_files) | set(hdd_files)):
+                    if path not in project_conflicts:
+                        sync_snapshot.write_states(path, pc_files.get(path), hdd_files.get(path))
+                # checksums of files changed on HDD other than by copying are stale
+                for path, checksum in stored_checksums.take(project_folder.as_posix() + "/"):
+                    if (path not in self._checksum_updates
+                            and not self._same_file_state(hdd_files.get(path), checksum[:2])):
+                        self._record_checksum(hdd_root / path, hdd_root, None)
+                if hdd_root in self.target_folders:
+                    self._update_location_index(project_folder, hdd_root)
+                if self.container_mode:
+                    self._pack_container(hdd_root / project_folder)
+
+                # remove project folder from lists unless it has conflicts
+                if project_conflicts:
+                    continue
+                synced.append(project_folder)
+                for filename, root_folder in ((self.FILENAME_PROJECTS_MODIFIED_PC, self.source_folder),
+                                              (self.FILENAME_PROJECTS_MODIFIED_HDD, self.target_folder)):
+                    projects_modified = self._read_project_folders_list(filename, root_folder)
+                    if project_folder in projects_modified:
+                        projects_modified.remove(project_folder)
+                        self._write_project_folders_list(filename, projects_modified)
+
+        self.queue_depth = 0
+        self._write_conflicts(conflicts)
+
+    def generator_manage_pc_budget(self):
+        """Generator that manages raw data on PC within the budget while yielding
+        progress messages.
+
+        Recency of a project folder is the latest of the newest modification time
+        of its files on PC and the last time its raw data were restored. Project
+        folders to be processed and project folders not backed up to the target
+        folder yet (see new_folders mode) are never evicted. Raw data are evicted
+        only once all of them are verified (by file sizes and SHA-256 digests) in
+        the target folder, missing ones are copied there first. They are deleted
+        permanently (not to trash), so that the space on PC is actually freed.
+
+        Yields:
+        A string with progess message. That is usually number of project folder
+        currently being processed, total number of project folders to process,
+        path of the currently processed project folder.
+        """
+        if self.pc_budget is None:
+            raise ValueError("Required parameter for this mode: pc_budget")
+        self._read_settings()
+        projects_pinned = set(self._read_project_folders_list(
+            self.FILENAME_PROJECTS_TO_BE_PROCESSED, self.source_folder))
+        access_times = self._read_access_times()
+        transferred = [] # project folders with raw data restored or evicted
+        try:
+            # restore raw data of reopened project folders
+            for project_folder in sorted(projects_pinned):
+                source = self.source_folder / project_folder
+                target = self._resolve_root(self.target_folder, project_folder) / project_folder
+                if not source.exists() or not target.exists():
+                    continue
+                restored_items = self._transfer_raw_items(target, source, "restore")
+                if restored_items:
+                    access_times[project_folder] = time.time()
+                    transferred.append(project_folder)
+                    yield f"Restored raw data of {project_folder} ({restored_items} items)"
+
+            # raw data currently on PC
+            raw_sizes = {}
+            for project_folder in self._get_project_folders(self.source_folder):
+                raw_items = self._get_raw_items(self.source_folder / project_folder)
+                if raw_items:
+                    raw_sizes[project_folder] = sum(
+                        self._estimate_folder_size(item) if item.is_dir() else item.stat().st_size
+                        for item in raw_items)
+                    access_times[project_folder] = max(
+                        access_times.get(project_folder, 0),
+                        self._get_last_modification_time(self.source_folder / project_folder))
+            total_size = sum(raw_sizes.values())
+            yield (f"Raw data on PC: {total_size / 1024**3:.2f} GB "
+                   f"(budget {self.pc_budget / 1024**3:.2f} GB)")
+
+            # evict least recently used raw data
+            candidates = sorted((project_folder for project_folder in raw_sizes
+                                 if project_folder not in projects_pinned),
+                                key=lambda project_folder: access_times[project_folder])
+            backed_up = set(self._get_target_project_folders())
+            for project_folder in candidates:
+                if total_size <= self.pc_budget:
+                    break
+                if project_folder not in backed_up or not self._is_connected(project_folder):
+                    yield (f"Raw data of {project_folder} kept on PC, the project folder is not "
+                           "backed up in the target folder (run new_folders mode first)")
+                    continue
+                source = self.source_folder / project_folder
+                # backed up project folders are indexed, so the drive is only looked up
+                target = self._resolve_root(self.target_folder, project_folder) / project_folder
+                self._transfer_raw_items(source, target)
+                if not self._raw_items_verified(source, target, compare_digests=True):
+                    yield f"Raw data of {project_folder} not verified in {target}, kept on PC"
+                    continue
+                for item in self._get_raw_items(source):
+                    self._delete_file(item, self.source_folder, "evict", trash=False)
+                transferred.append(project_folder)
+                total_size -= raw_sizes.pop(project_folder)
+                yield f"Evicted raw data of {project_folder} to {target}"
+            if total_size > self.pc_budget:
+                yield "Raw data on PC still exceed the budget."
+
+            self._write_project_folders_list(self.FILENAME_PROJECTS_WITH_RAW,
+                                             sorted(set(raw_sizes) - projects_pinned))
+            self._write_access_times(access_times)
+        finally:
+            self._update_sync_snapshot_pc(transferred)
+            self._flush_checksums()
+            self._update_tree_snapshot(transferred)
+
+    def generator_scrub_target(self):
+        """Generator that scrubs a slice of the target folder while yielding progress messages.
+
+        Files of project folders in the target folder (all drives of the pool) and
+        files with stored checksums are processed in sorted order of their paths,
+        starting after the last path processed by the previous run. A run stops
+        after hashing 1/scrub_days of total size of the target folder. Files without
+        a stored checksum get it recorded, as well as files whose size or modification
+        time changed since it was recorded (e.g. edited on HDD). Only files with the
+        same size and modification time but a different digest are corrupt. Progress and checksums are saved even if
+        the run gets interrupted. Files on drives of the pool which are not connected
+        are skipped.
+
+        Files are streamed from the scan of the target folder and merge-joined with
+        stored checksums, which are rewritten in the same pass. Only a batch of up
+        to VERIFY_BATCH_FILES files is hashed at once, so that memory does not depend
+        on number of files.
+
+        Yields:
+        A string with progess message. That is usually a path of a corrupt,
+        missing or repaired file.
+        """
+        total_files = total_size = 0
+        for _, _, size, _ in self._iter_target_files():
+            total_files += 1
+            total_size += size
+        slice_size = total_size / self.scrub_days
+        cursor = self._read_scrub_cursor()
+        yield (f"Scrubbing {total_files} files from "
+               f"{'the beginning' if not cursor else cursor}...")
+
+        done = False # the slice is complete, the rest of the target folder is not scanned
+        def target_files():
+            for target_file in self._iter_target_files(cursor):
+                if done:
+                    return None
+                yield target_file
+        files = _merge_join(self._read_checksums(), target_files(), key=lambda item: item[0])
+
+        self.autogen_folder.mkdir(exist_ok=True)
+        checksums_path = self.autogen_folder / self.FILENAME_CHECKSUMS
+        new_checksums_path = checksums_path.with_suffix(".tmp")
+        checksums = _RecordsWriter(new_checksums_path, CHECKSUMS_HEADER, CHECKSUMS_COLUMNS)
+        def write_checksum(path, checksum):
+            size, mtime, digest = checksum
+            checksums.write(path, size, mtime, bytes.fromhex(digest))
+        batch = deque() # tuples of stored checksum, target file and True to verify it
+        hashes = None
+        slice_processed = processed_size = 0
+        report = []
+        try:
+            for item in chain(files, [None]):
+                if item is not None:
+                    stored, target = item
+                    path = (stored or target)[0]
+                    verify = (not done and path > cursor and (
+                        target is not None or self._is_connected(Path(*Path(path).parts[:2]))))
+                    if verify and slice_processed > 0 and slice_processed >= slice_size:
+                        done, verify = True, False
+                    if verify:
+                        slice_processed += target[2] if target else 0
+                    elif not batch:
+                        if stored:
+                            write_checksum(*stored)
+                        continue
+                    batch.append((stored, target, verify))
+                    if len(batch) < self.VERIFY_BATCH_FILES:
+                        continue
+
+                # verify the batch
+                hashes = self._hash_files([target[:2] for _, target, verify in batch
+                                           if verify and target])
+                while batch:
+                    stored, target, verify = batch[0]
+                    path = (stored or target)[0]
+                    checksum = stored[1] if stored else None
+                    state = None
+                    if verify and target is None:
+                        state = "missing"
+                    elif verify:
+                        _, target_file, size, mtime = target
+                        digest, duration = next(hashes)
+                        self._record_file_operation("verify", target_file,
+                                                    self._get_file_root(target_file, path),
+                                                    time.perf_counter() - duration, size)
+                        processed_size += size
+                        if checksum is None or not self._same_file_state(checksum[:2], (size, mtime)):
+                            # new or changed (e.g. edited on HDD) since its checksum was recorded
+                            checksum = (size, mtime, digest)
+                        elif checksum[2] != digest:
+                            state = "corrupt"
+                    if state is not None:
+                        project_folder = Path(*Path(path).parts[:2])
+                        target_root = self._resolve_root(self.target_folder, project_folder)
+                        self._record_file_operation(state, target_root / path, target_root,
+                                                    time.perf_counter(), 0)
+                        if self._repair_target_file(path, checksum):
+                            state = "repaired"
+                        report.append((state, path))
+                    if checksum is not None:
+                        write_checksum(path, checksum)
+                    batch.popleft()
+                    if verify:
+                        cursor = path
+                    if state is not None:
+                        yield f"Scrubbed file {state}: {path}"
+                hashes.close()
+            if not done:
+                cursor = ""
+                yield "Whole target folder scrubbed, next run starts from the beginning."
+        finally:
+            if hashes is not None:
+                hashes.close()
+            # stored checksums of files not processed (e.g. if interrupted) are kept
+            done = True
+            for stored, _ in chain(((stored, None) for stored, _, _ in batch), files):
+                if stored:
+                    write_checksum(*stored)
+            checksums.close()
+            os.replace(new_checksums_path, checksums_path)
+            self._flush_checksums() # repaired files
+            self._write_scrub_cursor(cursor)
+            self._append_scrub_report(report)
+        yield f"Scrubbed {processed_size / 1024**2:.1f} MB, {len(report)} problems found."
+
+    def list_container_files(self, project_folder):
+        """Returns files packed in the container of a project folder in the target folder.
+
+        Reads only the index file of the container.
+
+        Args:
+            project_folder (pathlib.Path): Path to a project folder relative to root folder
+        Returns:
+            list of file paths relative to the project folder (str in posix format)
+        """
+        target = self._resolve_root(self.target_folder, Path(project_folder)) / project_folder
+        return list(self._read_container_index(target))
+
+    def restore_container_files(self, project_folder, destination, paths=None):
+        """Restores files packed in the container of a project folder in the target folder.
+
+        Files of uncompressed containers are read directly at their offsets,
+        compressed containers are streamed through.
+
+        Args:
+            project_folder (pathlib.Path): Path to a project folder relative to root folder
+            destination (pathlib.Path): Absolute path to folder to restore the files into
+              (keeping their paths relative to the project folder)
+            paths (list): Optional. File paths relative to the project folder (str in posix
+              format) to restore. All files are restored if None.
+        Returns:
+            number of restored files
+        """
+        target = self._resolve_root(self.target_folder, Path(project_folder)) / project_folder
+        return self._restore_container_files(target, destination, paths)
 
     def autogen_project_folders_with_raw(self):
         """Writes two .txt files with project folders expectedly and unexpectedly
@@ -242,8 +787,50 @@ class Backuper:
         with open(self.autogen_folder / "folders_with_raw_unexpected.txt", "w") as f:
             f.write("\n".join(unexpected_folders))
 
+    def autogen_modifications(self):
+        """Adds project folders with new, changed and deleted files on PC since
+        the last snapshot to the list in .autogen folder in utility folder and
+        updates the snapshot of files on PC.
+
+        The source folder is walked in sorted order, compared with the previous
+        snapshot by a streaming merge-join and written to the new snapshot in a
+        single pass (see _write_snapshot and _diff_snapshots), so that memory does
+        not depend on number of files. Files on PC get digests of their copies in
+        target folder with the same size (see _add_digests). Each line of the list
+        contains a project folder path relative to root folder and numbers of new,
+        changed and deleted files, separated by tabs. The numbers add up over runs
+        until the project folder is backed up by new_folders or modified_folders
+        mode, which both call this at their start. The list stays empty on the
+        first run.
+        """
+        snapshot_path = self.autogen_folder / self.FILENAME_TREE_SNAPSHOT
+        new_snapshot_path = snapshot_path.with_suffix(".tmp")
+        self.autogen_folder.mkdir(exist_ok=True)
+        current = _write_snapshot(new_snapshot_path,
+                                  self._add_digests(_walk_project_files(self.source_folder)))
+        modifications = self._read_modifications()
+        if snapshot_path.exists():
+            changes = ("new", "changed", "deleted")
+            for change, path in _diff_snapshots(_read_snapshot(snapshot_path), current):
+                project_folder = Path(*path.split("/", 2)[:2])
+                counts = modifications.setdefault(project_folder, [0, 0, 0])
+                counts[changes.index(change)] += 1
+        else:
+            for _ in current:
+                pass
+        os.replace(new_snapshot_path, snapshot_path)
+        self._write_modifications(modifications)
+
     # ------ UTILITIES ------
 
+    def _backup_utility_folder(self):
+        """Copies the utility folder to all target folders (keeping their drive ids).
+        """
+        for target_root in self.target_folders:
+            utility_target = target_root / self.utility_folder.name
+            shutil.copytree(self.utility_folder, utility_target, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns(self.FILENAME_DRIVE_ID))
+
     def _setter_root_folder(self, root, type):
         """Setter validation for source and target folders.
         """
@@ -273,9 +860,9 @@ class Backuper:
             f.write(self.EXAMPLE_LINE)
         with open(self.utility_folder / self.FILENAME_PROJECTS_MODIFIED_HDD, "w") as f:
             f.write(self.EXAMPLE_LINE)
-        with open(self.utility_folder / "project_folders_to_be_processed.txt", "w") as f:
+        with open(self.utility_folder / self.FILENAME_PROJECTS_TO_BE_PROCESSED, "w") as f:
             f.write(self.EXAMPLE_LINE)
-        with open(self.utility_folder / "project_folders_with_raw_on_pc.txt", "w") as f:
+        with open(self.utility_folder / self.FILENAME_PROJECTS_WITH_RAW, "w") as f:
             f.write(self.EXAMPLE_LINE)
 
         self.settings_folder = self.utility_folder / "settings"
@@ -293,7 +880,7 @@ class Backuper:
             pass
         with open(self.autogen_folder / "project_folders_list_pc.txt", "w") as f:
             pass
-        with open(self.autogen_folder / "project_folders_list_modifications.txt", "w") as f:
+        with open(self.autogen_folder / self.FILENAME_MODIFICATIONS, "w") as f:
             pass
 
     def _read_settings(self):
@@ -306,9 +893,9 @@ class Backuper:
             self.raw_selections = set(x.lower().strip() for x in f.read().split(","))
 
         projects_raw = self._read_project_folders_list(
-            "project_folders_with_raw_on_pc.txt", self.source_folder)
+            self.FILENAME_PROJECTS_WITH_RAW, self.source_folder)
         projects_unprocessed = self._read_project_folders_list(
-            "project_folders_to_be_processed.txt", self.source_folder)
+            self.FILENAME_PROJECTS_TO_BE_PROCESSED, self.source_folder)
         self.projects_with_raw = list(set(projects_raw) | set(projects_unprocessed))
     
     def _read_project_folders_list(self, file_name, root_folder):
@@ -362,6 +949,192 @@ class Backuper:
                 if project_folder.is_dir():
                     project_folders.append(project_folder.relative_to(root_folder))
         return project_folders
+
+    def _get_target_project_folders(self):
+        """Returns list of project folders paths present on any of the target folders.
+
+        With a single target folder, the folder is scanned directly. With a pool
+        of target folders, the location index is looked up instead of scanning
+        all the drives (see _read_location_index).
+
+        Returns:
+            list of project folder paths relative to target folders as pathlib.Path objects
+        """
+        if len(self.target_folders) <= 1:
+            return self._get_project_folders(self.target_folder)
+        return list(self._read_location_index())
+
+    def _read_location_index(self):
+        """Returns the location index as a dict mapping project folders to ids of
+        the target drives holding them.
+
+        The index is stored in .autogen folder in utility folder, each line
+        containing a project folder path relative to root folder and id of the
+        target drive holding it (see _get_drive_id), separated by a tab. Drives are
+        identified by ids rather than mount paths, so that the index stays valid
+        when a drive gets mounted elsewhere (e.g. under another drive letter).
+        If the index does not exist yet, it is built by scanning all target
+        folders once.
+
+        Returns:
+            dict of relative project folder paths (pathlib.Path) to drive ids (str)
+        """
+        if self._location_index is not None:
+            return self._location_index
+        index_path = self.autogen_folder / self.FILENAME_LOCATION_INDEX
+        if not index_path.exists():
+            self._location_index = {}
+            for drive_id, target_root in self._get_drive_roots().items():
+                for project_folder in self._get_project_folders(target_root):
+                    self._location_index.setdefault(project_folder, drive_id)
+            self._write_location_index()
+            return self._location_index
+
+        self._location_index = {}
+        with open(index_path, "r", encoding="utf-8") as f:
+            for line in f.readlines():
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                project_folder, drive_id = line.split("\t")
+                self._location_index[Path(project_folder)] = drive_id
+        return self._location_index
+
+    def _write_location_index(self):
+        """Writes the location index to .autogen folder in utility folder.
+
+        The index is also copied to backups of the utility folder on all target
+        folders, so that each drive of the pool knows the location of all projects.
+        """
+        lines = [f"{project_folder.as_posix()}\t{drive_id}\n" for project_folder,
+                 drive_id in sorted(self._location_index.items())]
+        self.autogen_folder.mkdir(exist_ok=True)
+        index_path = self.autogen_folder / self.FILENAME_LOCATION_INDEX
+        with open(index_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        for target_root in self.target_folders:
+            autogen_target = target_root / self.utility_folder.name / self.autogen_folder.name
+            if autogen_target.exists():
+                shutil.copy2(index_path, autogen_target)
+
+    def _update_location_index(self, project_folder, target_root):
+        """Records the target folder holding a project folder in the location index.
+
+        Only used with a pool of target folders.
+
+        Args:
+            project_folder (pathlib.Path): Path to a project folder relative to root folder
+            target_root (pathlib.Path): Absolute path to the target folder holding it
+        """
+        if len(self.target_folders) <= 1:
+            return None
+        self._read_location_index()[project_folder] = self._get_drive_id(target_root)
+        self._write_location_index()
+
+    def _get_drive_id(self, target_root):
+        """Returns id of the drive of a target folder, stored in the utility folder
+        on the drive. A new id is created for a drive without it.
+
+        Args:
+            target_root (pathlib.Path): Absolute path to a target folder
+        """
+        id_path = target_root / self.utility_folder.name / self.FILENAME_DRIVE_ID
+        if id_path.exists():
+            with open(id_path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        drive_id = uuid.uuid4().hex
+        os.makedirs(id_path.parent, exist_ok=True)
+        with open(id_path, "w", encoding="utf-8") as f:
+            f.write(drive_id)
+        return drive_id
+
+    def _get_drive_roots(self):
+        """Returns the target folders by ids of their drives (where they are currently mounted).
+
+        Returns:
+            dict of drive ids (str) to absolute target folder paths (pathlib.Path)
+        """
+        if self._drive_roots is None:
+            self._drive_roots = {self._get_drive_id(target_root): target_root
+                                 for target_root in self.target_folders}
+        return self._drive_roots
+
+    def _is_connected(self, project_folder):
+        """Returns False if a project folder is indexed on a target drive which is not
+        among the target folders (e.g. not plugged in), True otherwise.
+
+        Args:
+            project_folder (pathlib.Path): Path to a project folder relative to root folder
+        """
+        if len(self.target_folders) <= 1:
+            return True
+        drive_id = self._read_location_index().get(project_folder)
+        return drive_id is None or drive_id in self._get_drive_roots()
+
+    def _resolve_root(self, root_folder, project_folder):
+        """Returns the root folder actually holding a project folder.
+
+        If root_folder is the (primary) target folder and a pool of target folders
+        is used, the drive holding the project folder is looked up in the location
+        index and the target folder on it is returned. Project folders not indexed
+        yet are placed on a drive according to the placement policy. Otherwise
+        root_folder is returned.
+
+        Args:
+            root_folder (pathlib.Path): Absolute path to source or target folder
+            project_folder (pathlib.Path): Path to a project folder relative to root folder
+        Raises:
+            FileNotFoundError: if the drive holding the project folder is not connected
+        """
+        if len(self.target_folders) <= 1 or root_folder != self.target_folder:
+            return root_folder
+        drive_id = self._read_location_index().get(project_folder)
+        if drive_id is None:
+            return self._place_project_folder(project_folder) or self.target_folder
+        if drive_id not in self._get_drive_roots():
+            raise FileNotFoundError(f"Target drive '{drive_id}' holding '{project_folder}' "
+                                    "is not among the target folders.")
+        return self._get_drive_roots()[drive_id]
+
+    def _place_project_folder(self, project_folder):
+        """Chooses a target folder for a new project folder.
+
+        Estimates size of the project folder in the source folder and returns
+        a target folder from the pool with enough free space (keeping
+        FREE_SPACE_RESERVE bytes free), chosen according to the placement policy.
+
+        Args:
+            project_folder (pathlib.Path): Path to a project folder relative to source folder
+        Returns:
+            absolute path to the chosen target folder as pathlib.Path object,
+            or None if the project folder does not fit on any of the target folders
+        """
+        if len(self.target_folders) == 1:
+            return self.target_folder
+        size = self._estimate_folder_size(self.source_folder / project_folder)
+        candidates = []
+        for target_root in self.target_folders:
+            free_space = shutil.disk_usage(target_root).free - self.FREE_SPACE_RESERVE
+            if free_space >= size:
+                candidates.append((free_space, target_root))
+        if not candidates:
+            return None
+        if self.placement_policy == "fill_first":
+            return candidates[0][1]
+        return max(candidates, key=lambda candidate: candidate[0])[1]
+
+    @staticmethod
+    def _estimate_folder_size(folder):
+        """Returns total size of all files inside a folder in bytes.
+
+        Args:
+            folder (pathlib.Path): Absolute path to the folder.
+        """
+        size = 0
+        for dir_path, _, file_names in os.walk(folder):
+            for file_name in file_names:
+                size += os.path.getsize(os.path.join(dir_path, file_name))
+        return size
             
     def _contains_raw(self, folder):
         """Returns True if folder contains raw data
@@ -382,19 +1155,461 @@ class Backuper:
                     return True
         return False
 
+    def _get_raw_items(self, folder):
+        """Returns raw files and raw selection folders located directly in a folder.
+
+        Args:
+            folder (pathlib.Path): Absolute path to a project folder.
+        Returns:
+            list of absolute paths as pathlib.Path objects
+        """
+        raw_items = []
+        for item in folder.iterdir():
+            if item.is_dir():
+                if item.name.lower() in self.raw_selections:
+                    raw_items.append(item)
+            elif item.suffix.lstrip(".").lower() in self.raw_formats:
+                raw_items.append(item)
+        return raw_items
+
+    def _transfer_raw_items(self, source, target, operation="copy"):
+        """Copies raw files and raw selection folders missing in target project folder.
+
+        Args:
+            source (pathlib.Path): Absolute path to source project folder
+            target (pathlib.Path): Absolute path to target project folder
+            operation (str): Name of the copy operation to report
+        Returns:
+            number of copied raw items
+        """
+        os.makedirs(target, exist_ok=True)
+        target_root = target.parents[1]
+        n = 0
+        for source_item in self._get_raw_items(source):
+            target_item = target / source_item.name
+            if source_item.is_dir():
+                if not self._raw_items_verified(source_item, target_item):
+                    shutil.copytree(source_item, target_item, dirs_exist_ok=True,
+                                    copy_function=lambda src, dst: self._copy_file(
+                                        Path(src), Path(dst), target_root, operation))
+                    n += 1
+            elif not target_item.exists():
+                self._copy_file(source_item, target_item, target_root, operation)
+                n += 1
+        return n
+
+    def _raw_items_verified(self, source, target, compare_digests=False):
+        """Returns True if all files of raw data in source exist in target with the same size
+        (and the same SHA-256 digest if compare_digests is True).
+
+        Args:
+            source (pathlib.Path): Absolute path to source project folder or raw selection folder
+            target (pathlib.Path): Absolute path to target project folder or raw selection folder
+            compare_digests (bool): If True, contents of the files are compared by hashing
+        """
+        if source.name.lower() in self.raw_selections:
+            source_files = [Path(dir_path, file_name) for dir_path, _, file_names
+                            in os.walk(source) for file_name in file_names]
+        else:
+            source_files = []
+            for item in self._get_raw_items(source):
+                if item.is_dir():
+                    source_files += [Path(dir_path, file_name) for dir_path, _, file_names
+                                     in os.walk(item) for file_name in file_names]
+                else:
+                    source_files.append(item)
+        for source_file in source_files:
+            target_file = target / source_file.relative_to(source)
+            if not target_file.is_file():
+                return False
+            if target_file.stat().st_size != source_file.stat().st_size:
+                return False
+            if compare_digests and (_hash_path(target_file, self.HASH_CHUNK_SIZE)
+                                    != _hash_path(source_file, self.HASH_CHUNK_SIZE)):
+                return False
+        return True
+
+    @staticmethod
+    def _get_last_modification_time(folder):
+        """Returns the newest modification time of files inside a folder (0 if empty).
+
+        Args:
+            folder (pathlib.Path): Absolute path to the folder.
+        """
+        last_time = 0
+        for dir_path, _, file_names in os.walk(folder):
+            for file_name in file_names:
+                last_time = max(last_time, os.path.getmtime(os.path.join(dir_path, file_name)))
+        return last_time
+
+    def _read_access_times(self):
+        """Returns last access times of project folders stored in .autogen folder.
+
+        Returns:
+            dict of relative project folder paths (pathlib.Path) to timestamps (float)
+        """
+        access_times = {}
+        path = self.autogen_folder / self.FILENAME_ACCESS_TIMES
+        if not path.exists():
+            return access_times
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f.readlines():
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                project_folder, timestamp = line.split("\t")
+                access_times[Path(project_folder)] = float(timestamp)
+        return access_times
+
+    def _write_access_times(self, access_times):
+        """Writes last access times of project folders to .autogen folder.
+
+        Args:
+            access_times (dict): relative project folder paths (pathlib.Path) to timestamps (float)
+        """
+        lines = [f"{project_folder.as_posix()}\t{timestamp}\n" for project_folder,
+                 timestamp in sorted(access_times.items())]
+        self.autogen_folder.mkdir(exist_ok=True)
+        with open(self.autogen_folder / self.FILENAME_ACCESS_TIMES, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def _iter_target_files(self, start=""):
+        """Generator of files in project folders in the target folder (all drives of
+        the pool) with their sizes, sorted by their paths (see _scan_project_folders).
+
+        Project folders on drives of the pool which are not connected are skipped.
+
+        Args:
+            start (str): Optional. File path relative to root folder (str in posix
+              format), project folders before the one of the path are skipped.
+        Yields:
+            Tuples of file path relative to root folder (str in posix format), absolute
+            file path (pathlib.Path), size in bytes (int) and modification time in ns (int)
+        """
+        start_project = "/".join(start.split("/", 2)[:2]) + "/" if start else ""
+        project_folders = sorted((project_folder.as_posix() + "/", project_folder)
+                                 for project_folder in self._get_target_project_folders())
+        root_project_folders = ((self._resolve_root(self.target_folder, project_folder), project_folder)
+                                for prefix, project_folder in project_folders
+                                if prefix >= start_project and self._is_connected(project_folder))
+        for (target_root, _), files in self._scan_project_folders(root_project_folders):
+            for path, (size, mtime) in sorted(files.items()):
+                yield path, target_root / path, size, mtime
+
+    def _hash_file(self, path):
+        """Returns SHA-256 hex digest of a file, limiting the rate to scrub_rate_limit.
+
+        Args:
+            path (pathlib.Path): Absolute path to the file.
+        """
+        return _hash_path(path, self.HASH_CHUNK_SIZE, self.scrub_rate_limit)
+
+    def _hash_files(self, files):
+        """Generator hashing files, in a process pool if verify_workers > 1.
+
+        Files are split into tasks of up to VERIFY_TASK_FILES files of a single location
+        folder. Only a few tasks are submitted ahead, so the memory stays bounded.
+
+        Args:
+            files (iterable): Tuples of file path relative to root folder (str in posix
+              format) and absolute file path (pathlib.Path).
+        Yields:
+            Tuples of SHA-256 hex digest and hashing duration in seconds of the files
+            in the given order
+        """
+        if self.verify_workers <= 1:
+            for _, path in files:
+                start = time.perf_counter()
+                digest = self._hash_file(path)
+                yield digest, time.perf_counter() - start
+            return None
+
+        rate_limit = self.scrub_rate_limit / self.verify_workers if self.scrub_rate_limit else None
+        def tasks():
+            paths = []
+            location_folder = None
+            for path, file_path in files:
+                if paths and (path.split("/", 1)[0] != location_folder
+                              or len(paths) >= self.VERIFY_TASK_FILES):
+                    yield paths, self.HASH_CHUNK_SIZE, rate_limit
+                    paths = []
+                location_folder = path.split("/", 1)[0]
+                paths.append(str(file_path))
+            if paths:
+                yield paths, self.HASH_CHUNK_SIZE, rate_limit
+
+        with ProcessPoolExecutor(max_workers=self.verify_workers) as executor:
+            for results in _map_bounded(executor, _hash_paths, tasks(), 2 * self.verify_workers):
+                yield from results
+
+    def _repair_target_file(self, path, checksum):
+        """Copies a corrupt or missing file again from source folder.
+
+        The file is copied only if its copy in source folder matches the stored
+        checksum, and the copy in target folder is verified afterwards. A corrupt
+        file is safely deleted to trash first.
+
+        Args:
+            path (str): File path relative to root folder in posix format.
+            checksum (tuple): Stored size, modification time and SHA-256 hex digest
+              of the file.
+        Returns:
+            True if the file was repaired, False otherwise
+        """
+        size, _, digest = checksum
+        source_file = self.source_folder / path
+        if not source_file.is_file():
+            return False
+        if (source_file.stat().st_size, self._hash_file(source_file)) != (size, digest):
+            return False
+        project_folder = Path(*Path(path).parts[:2])
+        target_file = self._resolve_root(self.target_folder, project_folder) / path
+        root_folder = self._get_file_root(target_file, path)
+        if target_file.exists():
+            self._delete_file(target_file, root_folder)
+        os.makedirs(target_file.parent, exist_ok=True)
+        self._copy_file(source_file, target_file, root_folder, operation="repair")
+        return (target_file.stat().st_size, self._hash_file(target_file)) == (size, digest)
+
+    def _read_checksums(self):
+        """Generator reading stored checksums of files in target folder.
+
+        Checksums are stored in .autogen folder in utility folder as a compact file
+        of records sorted by file paths relative to root folder, with size,
+        modification time and SHA-256 digest of each file (see CHECKSUMS_COLUMNS).
+
+        Yields:
+            Tuples of file path relative to root folder (str in posix format) and
+            tuple of size (int), modification time in ns (int) and hex digest (str),
+            sorted by the paths
+        """
+        path = self.autogen_folder / self.FILENAME_CHECKSUMS
+        if not path.exists():
+            return None
+        for file_path, size, mtime, digest in _read_records(path, CHECKSUMS_HEADER,
+                                                            CHECKSUMS_COLUMNS):
+            yield file_path, (size, mtime, digest.hex())
+
+    def _write_checksums(self, checksums):
+        """Writes checksums of files in target folder to .autogen folder (see _read_checksums).
+
+        Args:
+            checksums (iterable): tuples of file path relative to root folder (str in
+              posix format) and tuple of size (int), modification time in ns (int) and
+              hex digest (str), sorted by the paths
+        """
+        self.autogen_folder.mkdir(exist_ok=True)
+        path = self.autogen_folder / self.FILENAME_CHECKSUMS
+        new_path = path.with_suffix(".tmp")
+        with _RecordsWriter(new_path, CHECKSUMS_HEADER, CHECKSUMS_COLUMNS) as writer:
+            for file_path, (size, mtime, digest) in checksums:
+                writer.write(file_path, size, mtime, bytes.fromhex(digest))
+        os.replace(new_path, path)
+
+    def _record_checksum(self, path, root_folder, checksum):
+        """Records checksum of a file written to target folder (see _flush_checksums).
+
+        Args:
+            path (pathlib.Path): Absolute path to the file
+            root_folder (pathlib.Path): Absolute path to root folder containing the file
+            checksum (tuple): Size (int), modification time in ns (int) and SHA-256 hex
+              digest (str) of the file, or None to forget its stored checksum
+        """
+        if root_folder in self.target_folders:
+            self._checksum_updates[path.relative_to(root_folder).as_posix()] = checksum
+
+    def _forget_checksums(self, path, root_folder):
+        """Forgets stored checksums of a file or of all files in a folder in target
+        folder, e.g. before they are changed or deleted (see _flush_checksums).
+
+        Args:
+            path (pathlib.Path): Absolute path to the file or folder
+            root_folder (pathlib.Path): Absolute path to root folder containing it
+        """
+        if root_folder not in self.target_folders:
+            return None
+        if not path.is_dir():
+            self._record_checksum(path, root_folder, None)
+            return None
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in file_names:
+                self._record_checksum(Path(dir_path, file_name), root_folder, None)
+
+    @contextmanager
+    def _checksums_flushed(self):
+        """Context manager flushing recorded checksums at its end, even if interrupted
+        (see _flush_checksums).
+        """
+        try:
+            yield
+        finally:
+            self._flush_checksums()
+
+    def _flush_checksums(self):
+        """Applies checksums recorded when files were written to target folder (and
+        forgotten ones) to stored checksums in a single streaming pass.
+
+        Checksums of files copied to target folder are recorded from the data read
+        while copying, so that scrub mode verifies them against their source rather
+        than trusting the first scrub that sees them. Files changed in other ways
+        (e.g. moved within a drive or edited on HDD) get their checksums forgotten
+        and recorded again by the next scrubs.
+        """
+        updates, self._checksum_updates = self._checksum_updates, {}
+        if not updates:
+            return None
+        checksums = _merge_join(self._read_checksums(), sorted(updates.items()),
+                                key=lambda item: item[0])
+        self._write_checksums(update if update is not None else stored
+                              for stored, update in checksums
+                              if update is None or update[1] is not None)
+
+    def _read_modifications(self):
+        """Returns project folders modified on PC listed by autogen_modifications.
+
+        Returns:
+            dict of project folder path relative to root folder (pathlib.Path) to
+            list of numbers of new, changed and deleted files
+        """
+        path = self.autogen_folder / self.FILENAME_MODIFICATIONS
+        modifications = {}
+        if not path.exists():
+            return modifications
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    project_folder, *counts = line.rstrip("\n").split("\t")
+                    modifications[Path(project_folder)] = list(map(int, counts))
+        return modifications
+
+    def _write_modifications(self, modifications):
+        """Writes project folders modified on PC (see _read_modifications).
+        """
+        with open(self.autogen_folder / self.FILENAME_MODIFICATIONS, "w", encoding="utf-8") as f:
+            for project_folder, counts in sorted(modifications.items()):
+                f.write("\t".join([project_folder.as_posix(), *map(str, counts)]) + "\n")
+
+    def _add_digests(self, entries):
+        """Generator filling digests of files on PC from stored checksums of their
+        copies in target folder (see _read_checksums), joined in a single streaming
+        pass.
+
+        A digest is taken only if the copy has the same size and modification time
+        (kept by copying) as the file on PC, i.e. neither of them changed since the
+        data were hashed. Files on PC are not hashed, other files have no digest.
+
+        Args:
+            entries (iterable): States of files sorted by paths (see _walk_project_files)
+        Yields:
+            The entries with digests (hex str) of the files with known checksums
+        """
+        for entry, checksum in _merge_join(entries, self._read_checksums(),
+                                           key=lambda item: item[0]):
+            if entry is None:
+                continue
+            path, size, mtime, digest = entry
+            if checksum is not None and checksum[1][:2] == (size, mtime):
+                digest = checksum[1][2]
+            yield path, size, mtime, digest
+
+    @contextmanager
+    def _tree_snapshot_updated(self, project_folders, backed_up=()):
+        """Context manager updating the snapshot of files on PC at its end, even if
+        interrupted (see _update_tree_snapshot). The lists are filled meanwhile.
+        """
+        try:
+            yield
+        finally:
+            self._update_tree_snapshot(project_folders, backed_up)
+
+    def _update_tree_snapshot(self, project_folders, backed_up=()):
+        """Updates the snapshot of files on PC (see autogen_modifications) in project
+        folders changed on PC by the current run and removes backed up project
+        folders from the list of modifications.
+
+        Changes done by the run itself (e.g. raw data moved to target folder) are
+        thus not listed by the next run. Only the given project folders are walked
+        again and their records are replaced in a single streaming pass over the
+        snapshot (see _RecordsMerge).
+
+        Args:
+            project_folders (iterable): Paths to project folders relative to root folder
+              changed on PC
+            backed_up (iterable): Paths to project folders relative to root folder
+              backed up to target folder
+        """
+        snapshot_path = self.autogen_folder / self.FILENAME_TREE_SNAPSHOT
+        if not project_folders or not snapshot_path.exists():
+            return None
+        project_folders = sorted(set(project_folders),
+                                 key=lambda project_folder: project_folder.as_posix() + "/")
+        entries = self._add_digests(_walk_project_files(self.source_folder, project_folders))
+        entry = next(entries, None)
+        with _RecordsMerge(snapshot_path, SNAPSHOT_HEADER, SNAPSHOT_COLUMNS) as snapshot:
+            for project_folder in project_folders:
+                prefix = project_folder.as_posix() + "/"
+                snapshot.take(prefix)
+                while entry is not None and entry[0].startswith(prefix):
+                    path, size, mtime, digest = entry
+                    snapshot.write(path, size, mtime,
+                                   bytes.fromhex(digest) if digest else SNAPSHOT_NO_DIGEST)
+                    entry = next(entries, None)
+        modifications = self._read_modifications()
+        if any(project_folder in modifications for project_folder in backed_up):
+            for project_folder in backed_up:
+                modifications.pop(project_folder, None)
+            self._write_modifications(modifications)
+
+    def _read_scrub_cursor(self):
+        """Returns path of the last file processed by scrub mode ("" to start from the beginning).
+        """
+        path = self.autogen_folder / self.FILENAME_SCRUB_PROGRESS
+        if not path.exists():
+            return ""
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def _write_scrub_cursor(self, cursor):
+        """Writes path of the last file processed by scrub mode to .autogen folder.
+        """
+        self.autogen_folder.mkdir(exist_ok=True)
+        with open(self.autogen_folder / self.FILENAME_SCRUB_PROGRESS, "w", encoding="utf-8") as f:
+            f.write(cursor)
+
+    def _append_scrub_report(self, report):
+        """Appends corrupt, missing and repaired files found by scrub mode to .autogen folder.
+
+        Args:
+            report (list): tuples of state ("corrupt", "missing" or "repaired") and
+              file path relative to root folder
+        """
+        if not report:
+            return None
+        timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        lines = [f"{timestamp}\t{state}\t{path}\n" for state, path in report]
+        self.autogen_folder.mkdir(exist_ok=True)
+        with open(self.autogen_folder / self.FILENAME_SCRUB_REPORT, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
     @staticmethod
     def _compare_project_folders(source_project_folders, target_project_folders):
         """
         Finds project folders in the source that do not exist in the target.
 
+        Both lists are sorted and compared by a streaming merge-join (see _merge_join).
+
         Args:
             source_project_folders (list): List of project folders in the source.
             target_project_folders (list): List of project folders in the target.
         
         Returns:
-            list of new project folders
+            sorted list of new project folders
         """
-        return list(set(source_project_folders) - set(target_project_folders))
+        key = lambda project_folder: Path(project_folder).as_posix()
+        return [source for source, target in _merge_join(sorted(source_project_folders, key=key),
+                                                         sorted(target_project_folders, key=key),
+                                                         key)
+                if target is None]
 
     def _backup_project_folder(self, project_folder, move_raw=True, source=None, target=None):
         '''Backs up single project folder
@@ -412,71 +1627,631 @@ class Backuper:
             target = self.target_folder / project_folder
 
         os.makedirs(target, exist_ok=True)
+        target_root = target.parents[1]
 
+        packed_files = [] # small files to pack into the container (container mode only)
         for source_item_path in source.iterdir():
             target_item_path = target.joinpath(source_item_path.name)
 
             if os.path.isfile(source_item_path):
                 file_extension = source_item_path.suffix[1:].lower()
                 if move_raw and file_extension in self.raw_formats:
-                    shutil.move(source_item_path, target_item_path)
+                    self._copy_file(source_item_path, target_item_path, target_root, "move")
+                elif file_extension not in self.raw_formats and self._is_packed(source_item_path):
+                    packed_files.append(source_item_path)
                 else:
-                    shutil.copy2(source_item_path, target_item_path)
+                    self._copy_file(source_item_path, target_item_path, target_root)
             elif os.path.isdir(source_item_path):
                 if move_raw and source_item_path.name.lower() in self.raw_selections:
-                    shutil.move(source_item_path, target_item_path)
+                    self._copy_file(source_item_path, target_item_path, target_root, "move")
+                elif self.container_mode and source_item_path.name.lower() not in self.raw_selections:
+                    for dir_path, _, file_names in os.walk(source_item_path):
+                        for file_name in file_names:
+                            path = Path(dir_path, file_name)
+                            if self._is_packed(path):
+                                packed_files.append(path)
+                            else:
+                                target_path = target / path.relative_to(source)
+                                os.makedirs(target_path.parent, exist_ok=True)
+                                self._copy_file(path, target_path, target_root)
                 else:
-                    shutil.copytree(source_item_path, target_item_path)
+                    shutil.copytree(source_item_path, target_item_path,
+                                    copy_function=lambda src, dst: self._copy_file(
+                                        Path(src), Path(dst), target_root))
 
-    def _subgenerator_modified_folders(self, project_folders, source_folder, target_folder):
-        """Generator that backs up modified folders in a single direction.
-        
-        Used as part of modified_folders mode to avoid code repetition.
-        
-        Backs up provided project folders modified on source to target while yielding
-        progress messages.
+        if packed_files:
+            self._write_container(source, target, packed_files)
+
+    def _copy_file(self, source, target, root_folder, operation="copy"):
+        """Copies (or moves) a file or folder, reporting the operation (see
+        _record_file_operation). Checksums of files copied to target folder are
+        recorded (see _flush_checksums).
+
+        Args:
+            source (pathlib.Path): Absolute path to the source file or folder
+            target (pathlib.Path): Absolute path to the target file or folder
+            root_folder (pathlib.Path): Absolute path to root folder containing target
+            operation (str): "move" to move the file, any other name to copy it
+        """
+        start = time.perf_counter()
+        checksums = {} # files copied to target folder are hashed while copying
+        def copy_function(source_file, target_file):
+            if root_folder not in self.target_folders:
+                return shutil.copy2(source_file, target_file)
+            checksums[target_file] = _copy_path(source_file, target_file, self.HASH_CHUNK_SIZE)
+            return target_file
+        try:
+            if operation == "move":
+                shutil.move(source, target, copy_function=copy_function)
+            else:
+                copy_function(source, target)
+        except OSError:
+            self._record_file_operation("error", target, root_folder, start, 0)
+            raise
+        self._forget_checksums(target, root_folder) # e.g. moved within the drive
+        for target_file, checksum in checksums.items():
+            self._record_checksum(Path(target_file), root_folder, checksum)
+        self._record_file_operation(operation, target, root_folder, start)
+
+    def _delete_file(self, path, root_folder, operation="delete", trash=True):
+        """Deletes a file (or folder), safely to trash unless told otherwise,
+        reporting the operation (see _record_file_operation).
+
+        Args:
+            path (pathlib.Path): Absolute path to the file or folder
+            root_folder (pathlib.Path): Absolute path to root folder containing the file
+            operation (str): Name of the operation to report
+            trash (bool): Delete permanently if False (e.g. verified copies elsewhere)
+        """
+        start = time.perf_counter()
+        size = 0
+        if self._file_operations_reported():
+            size = self._estimate_folder_size(path) if path.is_dir() else path.stat().st_size
+        self._forget_checksums(path, root_folder)
+        if trash:
+            send2trash(path)
+        elif path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+        self._record_file_operation(operation, path, root_folder, start, size)
+
+    @staticmethod
+    def _get_file_root(path, relative_path):
+        """Returns root folder of a file given its absolute and relative path.
+
+        Args:
+            path (pathlib.Path): Absolute path to the file
+            relative_path (str): File path relative to root folder in posix format
+        """
+        return path.parents[len(Path(relative_path).parts) - 1]
+
+    def _file_operations_reported(self):
+        """Returns True if file operations are reported (to file_operation_callback or debug log).
+        """
+        return self.file_operation_callback is not None or logger.isEnabledFor(logging.DEBUG)
+
+    def _record_file_operation(self, operation, path, root_folder, start, size=None):
+        """Reports a finished file operation to file_operation_callback (if set) and
+        to debug log (if enabled). Does nothing otherwise, to keep per file overhead low.
+
+        Args:
+            operation (str): Name of the operation (e.g. "copy", "move", "delete", "pack")
+            path (pathlib.Path): Absolute path to the file (or folder) operated on
+            root_folder (pathlib.Path): Absolute path to root folder containing the path
+            start (float): Value of time.perf_counter() at start of the operation
+            size (int): Optional. Size in bytes (read from path if None)
+        """
+        if not self._file_operations_reported():
+            return None
+        duration = time.perf_counter() - start
+        if size is None:
+            size = self._estimate_folder_size(path) if path.is_dir() else path.stat().st_size
+        relative_path = path.relative_to(root_folder)
+        project_folder = Path(*relative_path.parts[:2]).as_posix()
+        relative_path = relative_path.as_posix()
+        device = str(root_folder)
+        if self.file_operation_callback is not None:
+            self.file_operation_callback(operation, device, project_folder, relative_path,
+                                         size, duration)
+        # structured record, fields are available to handlers as record attributes
+        logger.debug("%s %s (%d B, %.3f s)", operation, relative_path, size, duration,
+                     extra={"operation": operation, "device": device,
+                            "project_folder": project_folder, "path": relative_path,
+                            "size": size, "duration": duration})
+
+    def _is_packed(self, path):
+        """Returns True if a file shall be packed into a container (in container mode only).
+
+        Raw data are never packed, so that they can be verified and restored as plain files.
+        """
+        return self.container_mode and os.path.getsize(path) <= self.CONTAINER_MAX_FILE_SIZE
+
+    def _get_container_path(self, target):
+        """Returns path to the container in a target project folder.
+
+        Args:
+            target (pathlib.Path): Absolute path to target project folder
+        """
+        for compression in [None] + self.CONTAINER_COMPRESSIONS:
+            name = self.CONTAINER_NAME + (f".{compression}" if compression else "")
+            if (target / name).exists():
+                return target / name
+        raise FileNotFoundError(f"Container not found in '{target}'.")
+
+    def _write_container(self, source, target, files):
+        """Packs files into a single streamed tar container in target project folder.
+
+        Also writes an index file with size, modification time and offset of data
+        (in uncompressed tar stream) for each file, each line containing a file path
+        relative to the project folder and these values, separated by tabs.
 
         Args:
-            project_folders (list): list of project folders' paths relative to
-                a root folder.
-            source_folder (pathlib.Path object): absolute path to source folder.
-            target_folder (pathlib.Path object): absolute path to target folder.
+            source (pathlib.Path): Absolute path to source project folder
+            target (pathlib.Path): Absolute path to target project folder
+            files (list): absolute paths to files in source project folder to pack
+        """
+        # checksums of the container and the index are recorded while writing them
+        name = self.CONTAINER_NAME
+        mode = "w|"
+        if self.container_compression:
+            name += f".{self.container_compression}"
+            mode += self.container_compression
+        lines = []
+        with open(target / name, "wb") as f:
+            container = _HashingWriter(f)
+            with tarfile.open(fileobj=container, mode=mode) as tar:
+                for path in files:
+                    start = time.perf_counter()
+                    tarinfo = tar.gettarinfo(path, arcname=path.relative_to(source).as_posix())
+                    with open(path, "rb") as source_file:
+                        tar.addfile(tarinfo, source_file)
+                    self._record_file_operation("pack", target / tarinfo.name, target.parents[1],
+                                                start, tarinfo.size)
+                    offset = tar.offset - -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                    lines.append(f"{tarinfo.name}\t{tarinfo.size}\t{tarinfo.mtime}\t{offset}\n")
+        self._record_checksum(target / name, target.parents[1],
+                              (container.size, (target / name).stat().st_mtime_ns,
+                               container.hash.hexdigest()))
+        index = "".join(lines).encode("utf-8")
+        with open(target / self.CONTAINER_INDEX_NAME, "wb") as f:
+            f.write(index)
+        self._record_checksum(target / self.CONTAINER_INDEX_NAME, target.parents[1],
+                              (len(index), (target / self.CONTAINER_INDEX_NAME).stat().st_mtime_ns,
+                               hashlib.sha256(index).hexdigest()))
+
+    def _read_container_index(self, target):
+        """Returns index of the container in a target project folder.
+
+        Args:
+            target (pathlib.Path): Absolute path to target project folder
+        Returns:
+            dict of file paths relative to the project folder (str in posix format) to
+            tuples of size (int), modification time (float) and data offset (int)
+        """
+        index = {}
+        with open(target / self.CONTAINER_INDEX_NAME, "r", encoding="utf-8") as f:
+            for line in f.readlines():
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                path, size, mtime, offset = line.split("\t")
+                index[path] = (int(size), float(mtime), int(offset))
+        return index
+
+    def _restore_container_files(self, target, destination, paths=None):
+        """Restores files packed in the container of a target project folder
+        (see restore_container_files).
+
+        Args:
+            target (pathlib.Path): Absolute path to target project folder
+            destination (pathlib.Path): Absolute path to folder to restore the files into
+            paths (list): Optional. File paths relative to the project folder to restore.
+        Returns:
+            number of restored files
+        """
+        index = self._read_container_index(target)
+        if paths is None:
+            paths = list(index)
+        paths = set(paths)
+        missing = paths - set(index)
+        if missing:
+            raise FileNotFoundError(f"Files not found in container in '{target}': "
+                                    f"{', '.join(sorted(missing))}")
+        destination = Path(destination)
+        container = self._get_container_path(target)
+        n = 0
+        if container.name == self.CONTAINER_NAME:
+            with open(container, "rb") as f:
+                for path in sorted(paths):
+                    size, mtime, offset = index[path]
+                    f.seek(offset)
+                    self._write_restored_file(destination / path, f, size, mtime)
+                    n += 1
+        else:
+            with tarfile.open(container, mode=f"r|{container.suffix[1:]}") as tar:
+                for member in tar:
+                    if member.name in paths:
+                        size, mtime, _ = index[member.name]
+                        self._write_restored_file(destination / member.name,
+                                                  tar.extractfile(member), size, mtime)
+                        n += 1
+        return n
+
+    @staticmethod
+    def _write_restored_file(path, source_file, size, mtime):
+        """Writes size bytes from a file object to a restored file and sets its mtime.
+        """
+        os.makedirs(path.parent, exist_ok=True)
+        with open(path, "wb") as f:
+            remaining = size
+            while remaining:
+                chunk = source_file.read(min(remaining, 1024**2))
+                if not chunk:
+                    raise EOFError(f"Container ended before restoring '{path}'.")
+                f.write(chunk)
+                remaining -= len(chunk)
+        os.utime(path, (mtime, mtime))
+
+    def _pack_container(self, target):
+        """Packs small files of a target project folder into a new container (see
+        _backup_project_folder) and removes them as plain files. Raw data are
+        never packed.
+
+        Args:
+            target (pathlib.Path): Absolute path to target project folder
+        Returns:
+            True if any files were packed, False otherwise
+        """
+        if not target.exists():
+            return False
+        root_folder = target.parents[1]
+        project_folder = target.relative_to(root_folder)
+        files = []
+        for dir_path, _, file_names in os.walk(target):
+            for file_name in file_names:
+                path = Path(dir_path, file_name)
+                if (not self._is_raw_path(path.relative_to(root_folder).as_posix(), project_folder)
+                        and self._is_packed(path)):
+                    files.append(path)
+        if not files:
+            return False
+        self._write_container(target, target, sorted(files))
+        for path in files:
+            self._forget_checksums(path, root_folder)
+            path.unlink()
+            self._remove_emptied_folders(path, target)
+        return True
+
+    def _unpack_containers(self, target):
+        """Unpacks the container in a target project folder (if any) into plain files
+        and removes the container with its index.
+
+        Args:
+            target (pathlib.Path): Absolute path to target project folder
+        """
+        if not (target / self.CONTAINER_INDEX_NAME).exists():
+            return None
+        container = self._get_container_path(target)
+        root_folder = target.parents[1]
+        for path in self._read_container_index(target):
+            self._record_checksum(target / path, root_folder, None)
+        self._restore_container_files(target, target)
+        for path in (container, target / self.CONTAINER_INDEX_NAME):
+            self._forget_checksums(path, root_folder)
+            path.unlink()
+
+    def _scan_files(self, root_folder, project_folder):
+        """Returns state of all files inside a project folder. Reports the scan as
+        a file operation of the project folder (see _record_file_operation).
+
+        Args:
+            root_folder (pathlib.Path): Absolute path to root folder
+            project_folder (pathlib.Path): Path to a project folder relative to root folder
+        Returns:
+            dict of file paths relative to root folder (str in posix format) to
+            tuples of size (int) and modification time in nanoseconds (int)
+        """
+        (scan,) = _scan_folders([(str(root_folder), Path(project_folder).as_posix())])
+        return self._read_scan(root_folder, project_folder, scan)
+
+    def _read_scan(self, root_folder, project_folder, scan):
+        """Returns state of files from a compact scan of a project folder (see
+        _scan_folders) and reports the scan (see _scan_files).
+        """
+        folders, folder_indexes, names, sizes, mtimes, duration = scan
+        files = {f"{folders[i]}/{name}": (size, mtime)
+                 for i, name, size, mtime in zip(folder_indexes, names, sizes, mtimes)}
+        self._record_file_operation("scan", root_folder / project_folder, root_folder,
+                                    time.perf_counter() - duration, sum(sizes))
+        return files
+
+    def _scan_project_folders(self, root_project_folders):
+        """Generator scanning project folders (see _scan_files), in a process pool
+        if scan_workers > 1.
+
+        In the process pool, work is split into tasks of up to SCAN_TASK_FOLDERS
+        project folders taken in the given order. Each worker sends back compact
+        results (see _scan_folders) and only a few tasks are submitted ahead, so the
+        memory stays bounded regardless of size of the tree. Project folders are
+        taken from the iterable only when their task is submitted.
 
+        Args:
+            root_project_folders (iterable): Tuples of absolute path to root folder
+              (pathlib.Path) and path to a project folder relative to it (pathlib.Path)
         Yields:
-        A string with progess message. That is usually number of project folder
-        currently being processed, total number of project folders to process,
-        path of the currently processed project folder.
+            Tuples of the (root folder, project folder) tuple and state of its files
+            (see _scan_files), in the given order
         """
-        n = len(project_folders)
-        if n == 0:
-            yield f"No modified project folders found in {source_folder}."
+        if self.scan_workers <= 1:
+            for root_folder, project_folder in root_project_folders:
+                yield (root_folder, project_folder), self._scan_files(root_folder, project_folder)
             return None
-        for i, project_folder in enumerate(project_folders):
-            progress_msg = f"Backing up modified folder {i+1:2}/{n}: {project_folder}"
-            yield progress_msg
 
-            source = source_folder / project_folder
-            target = target_folder / project_folder
-            
-            # safely delete old content
-            # TODO rewrite this method as described in the design document to avoid
-            # unnesesarily deleting and copying files that should be kept
-            if target.exists():
-                send2trash(target)
-
-            # copy new content
-            move_raw = project_folder not in self.projects_with_raw
-            self._backup_project_folder(project_folder, move_raw=move_raw,
-                                        source=source, target=target)
-
-            # remove project folder from list
-            if source_folder == self.source_folder:
-                filename = self.FILENAME_PROJECTS_MODIFIED_PC
+        chunks = deque() # project folders of tasks submitted ahead
+        def tasks():
+            chunk = []
+            for root_project_folder in root_project_folders:
+                chunk.append(root_project_folder)
+                if len(chunk) >= self.SCAN_TASK_FOLDERS:
+                    chunks.append(chunk)
+                    yield ([(str(root), Path(project).as_posix()) for root, project in chunk],)
+                    chunk = []
+            if chunk:
+                chunks.append(chunk)
+                yield ([(str(root), Path(project).as_posix()) for root, project in chunk],)
+
+        with ProcessPoolExecutor(max_workers=self.scan_workers) as executor:
+            for scans in _map_bounded(executor, _scan_folders, tasks(), 2 * self.scan_workers):
+                for (root_folder, project_folder), scan in zip(chunks.popleft(), scans):
+                    yield ((root_folder, project_folder),
+                           self._read_scan(root_folder, project_folder, scan))
+
+    @staticmethod
+    def _same_file_state(state1, state2):
+        """Returns True if two file states (size, mtime in ns) describe the same file
+        on different devices (tolerating 2 s mtime resolution of FAT file systems).
+        """
+        if state1 is None or state2 is None:
+            return state1 == state2
+        return state1[0] == state2[0] and abs(state1[1] - state2[1]) <= 2 * 10**9
+
+    def _is_raw_path(self, path, project_folder):
+        """Returns True if a file is raw data of a project folder, i.e. it has a raw
+        file format and is located directly in the project folder, or it is located
+        in a raw selection folder.
+
+        Args:
+            path (str): File path relative to root folder in posix format.
+            project_folder (pathlib.Path): Path to the project folder relative to root folder
+        """
+        parts = Path(path).relative_to(project_folder).parts
+        if len(parts) == 1:
+            return Path(parts[0]).suffix.lstrip(".").lower() in self.raw_formats
+        return parts[0].lower() in self.raw_selections
+
+    def _plan_reconciliation(self, project_folder, pc_files, hdd_files, snapshot,
+                             listed_side, move_raw):
+        """Returns plan of actions reconciling a project folder on PC and HDD.
+
+        For each file, its current state on PC and HDD is compared to the sync
+        snapshot to find the side it changed on. Without a snapshot of the project
+        folder (first sync, e.g. of a project folder backed up by new_folders mode),
+        the baseline is seeded from the side it is not listed for, so that changes
+        of the listed side are propagated. Raw data (if they shall be moved) always
+        stay on or go to the HDD. Raw data missing on PC are never deleted from HDD
+        unless the project folder still keeps some raw data on PC (otherwise they are
+        missing because they were moved to HDD), delete them on HDD instead.
+
+        Args:
+            project_folder (pathlib.Path): Path to the project folder relative to root folder
+            pc_files (dict): States of files in the project folder on PC (see _scan_files)
+            hdd_files (dict): States of files in the project folder on HDD (see _scan_files)
+            snapshot (dict): Sync snapshot of the project folder, file paths relative
+              to root folder to states of files on PC and HDD (see _read_sync_snapshot)
+            listed_side (str): "pc" or "hdd" for the modified list the project folder
+              is listed in, None if listed in both
+            move_raw (bool): If True, raw data are kept only on HDD
+        Returns:
+            list of tuples of action ("copy_to_hdd", "move_to_hdd", "copy_to_pc",
+            "delete_hdd", "delete_pc" or "conflict") and file path relative to root folder
+        """
+        has_snapshot = bool(snapshot)
+        raw_on_pc = any(self._is_raw_path(path, project_folder) for path in pc_files)
+        plan = []
+        for path in sorted(set(pc_files) | set(hdd_files)):
+            pc, hdd = pc_files.get(path), hdd_files.get(path)
+            raw_path = self._is_raw_path(path, project_folder)
+            raw = move_raw and raw_path
+            same = self._same_file_state(pc, hdd)
+
+            # find side the file changed on (mtimes of files unpacked from containers
+            # are restored with a lower precision)
+            if has_snapshot:
+                pc_base, hdd_base = snapshot.get(path, (None, None))
+                pc_changed = not self._same_file_state(pc, pc_base)
+                hdd_changed = not self._same_file_state(hdd, hdd_base)
+            elif listed_side == "pc":
+                # baseline seeded from HDD, raw data are expected only there unless kept on PC
+                pc_base = hdd if not raw or raw_on_pc else None
+                pc_changed, hdd_changed = not self._same_file_state(pc, pc_base), False
+            elif listed_side == "hdd":
+                # baseline seeded from PC
+                pc_changed, hdd_changed = False, not same
             else:
-                filename = self.FILENAME_PROJECTS_MODIFIED_HDD
-            projects_modified = self._read_project_folders_list(filename, source_folder)
-            projects_modified.remove(project_folder)
-            self._write_project_folders_list(filename, projects_modified)                                            
+                pc_changed = hdd_changed = True
+            if pc_changed and hdd_changed:
+                if same or (raw and pc is None):
+                    changed_side = None
+                else:
+                    plan.append(("conflict", path))
+                    continue
+            elif pc_changed:
+                changed_side = "pc"
+            elif hdd_changed:
+                changed_side = "hdd"
+            else:
+                changed_side = None
+
+            if changed_side == "pc":
+                if pc is None:
+                    if not raw_path or raw_on_pc:
+                        plan.append(("delete_hdd", path))
+                elif not same:
+                    plan.append(("move_to_hdd" if raw else "copy_to_hdd", path))
+                elif raw:
+                    plan.append(("delete_pc", path))
+            elif changed_side == "hdd":
+                if hdd is None:
+                    plan.append(("move_to_hdd" if raw else "delete_pc", path))
+                elif raw:
+                    if pc is not None:
+                        plan.append(("delete_pc", path))
+                elif not same:
+                    plan.append(("copy_to_pc", path))
+            elif raw and pc is not None:
+                if same:
+                    plan.append(("delete_pc", path))
+                elif hdd is None:
+                    plan.append(("move_to_hdd", path))
+        return plan
+
+    def _apply_reconciliation(self, plan, pc_root, hdd_root):
+        """Applies plan of actions reconciling a project folder (see _plan_reconciliation).
+
+        Files are deleted safely to trash. Folders left empty by deleting (or moving
+        away) files are removed, other empty folders are kept.
+
+        Args:
+            plan (list): tuples of action and file path relative to root folder
+            pc_root (pathlib.Path): Absolute path to root folder on PC
+            hdd_root (pathlib.Path): Absolute path to root folder on HDD
+        """
+        for action, path in plan:
+            pc_file, hdd_file = pc_root / path, hdd_root / path
+            match action:
+                case "copy_to_hdd" | "move_to_hdd":
+                    os.makedirs(hdd_file.parent, exist_ok=True)
+                    if hdd_file.exists():
+                        send2trash(hdd_file)
+                    operation = "copy" if action == "copy_to_hdd" else "move"
+                    self._copy_file(pc_file, hdd_file, hdd_root, operation)
+                case "copy_to_pc":
+                    os.makedirs(pc_file.parent, exist_ok=True)
+                    if pc_file.exists():
+                        send2trash(pc_file)
+                    self._copy_file(hdd_file, pc_file, pc_root, "copy_to_pc")
+                case "delete_hdd":
+                    self._delete_file(hdd_file, hdd_root)
+                case "delete_pc":
+                    self._delete_file(pc_file, pc_root, "delete_pc")
+            project_folder = Path(*Path(path).parts[:2])
+            if action in ("move_to_hdd", "delete_pc"):
+                self._remove_emptied_folders(pc_file, pc_root / project_folder)
+            elif action == "delete_hdd":
+                self._remove_emptied_folders(hdd_file, hdd_root / project_folder)
+
+    @staticmethod
+    def _remove_emptied_folders(path, project_folder):
+        """Removes folders left empty by deleting (or moving away) a file, from the
+        folder of the file up to the project folder, which is kept even if empty.
+
+        Args:
+            path (pathlib.Path): Absolute path to the removed file
+            project_folder (pathlib.Path): Absolute path to the project folder containing it
+        """
+        folder = path.parent
+        while folder != project_folder and folder.is_dir() and not any(folder.iterdir()):
+            folder.rmdir()
+            folder = folder.parent
+
+    def _read_sync_snapshot(self):
+        """Generator reading sync snapshot, i.e. states of files on PC and HDD after
+        the last sync.
+
+        The snapshot is stored in .autogen folder in utility folder as a compact file
+        of records sorted by file paths relative to root folder, with size and
+        modification time in nanoseconds of each file on PC and on HDD (see
+        SYNC_SNAPSHOT_COLUMNS). It is rewritten by a streaming merge (see
+        _open_sync_snapshot).
+
+        Yields:
+            Tuples of file path relative to root folder (str in posix format) and tuple
+            of file states on PC and HDD (tuple of size and mtime in ns, or None)
+        """
+        path = self.autogen_folder / self.FILENAME_SYNC_SNAPSHOT
+        if not path.exists():
+            return None
+        for file_path, *values in _read_records(path, SYNC_SNAPSHOT_HEADER, SYNC_SNAPSHOT_COLUMNS):
+            yield file_path, _unpack_sync_states(values)
+
+    def _get_synced_project_folders(self, project_folders):
+        """Returns project folders with records in sync snapshot, i.e. synced by
+        modified_folders mode before, looked up in a single streaming pass.
+
+        Args:
+            project_folders (iterable): Paths to project folders relative to root folder
+        Returns:
+            list of the synced project folders as pathlib.Path objects
+        """
+        prefixes = sorted((project_folder.as_posix() + "/", project_folder)
+                          for project_folder in project_folders)
+        with closing(_RecordsCursor(self._read_sync_snapshot())) as sync_snapshot:
+            return [project_folder for prefix, project_folder in prefixes
+                    if sync_snapshot.take(prefix)]
+
+    def _open_sync_snapshot(self):
+        """Returns a merge rewriting sync snapshot by project folders in a single
+        streaming pass (see _SyncSnapshotMerge), to be closed after the last one.
+        """
+        self.autogen_folder.mkdir(exist_ok=True)
+        return _SyncSnapshotMerge(self.autogen_folder / self.FILENAME_SYNC_SNAPSHOT)
+
+    def _update_sync_snapshot_pc(self, project_folders):
+        """Updates states of raw data on PC in sync snapshot of project folders.
+
+        Used when raw data are evicted from or restored to PC by pc_budget mode,
+        so that it is not considered a modification of the project folder on PC
+        (e.g. evicted raw files are not deleted from HDD by modified_folders mode).
+        Project folders never synced are left to the baseline seeded by their first
+        sync (see _plan_reconciliation).
+
+        Args:
+            project_folders (iterable): Paths to project folders relative to root folder
+        """
+        if not project_folders or not (self.autogen_folder / self.FILENAME_SYNC_SNAPSHOT).exists():
+            return None
+        with self._open_sync_snapshot() as merge:
+            for project_folder in sorted(project_folders, key=lambda p: p.as_posix() + "/"):
+                snapshot = merge.take_project(project_folder)
+                if not snapshot:
+                    continue
+                pc_files = self._scan_files(self.source_folder, project_folder)
+                hdd_root = self._resolve_root(self.target_folder, project_folder)
+                hdd_files = self._scan_files(hdd_root, project_folder)
+                for path in sorted(set(pc_files) | set(hdd_files) | set(snapshot)):
+                    if not self._is_raw_path(path, project_folder):
+                        if path in snapshot:
+                            merge.write_states(path, *snapshot[path])
+                        continue
+                    hdd = snapshot.get(path, (None, hdd_files.get(path)))[1]
+                    if pc_files.get(path) is not None or hdd is not None:
+                        merge.write_states(path, pc_files.get(path), hdd)
+
+    def _write_conflicts(self, conflicts):
+        """Writes files changed on both PC and HDD found by modified_folders mode
+        to .autogen folder (removes the file if there are no conflicts).
+
+        Args:
+            conflicts (list): file paths relative to root folder
+        """
+        path = self.autogen_folder / self.FILENAME_SYNC_CONFLICTS
+        if not conflicts:
+            path.unlink(missing_ok=True)
+            return None
+        self.autogen_folder.mkdir(exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(conflicts))
 
     # -------------------------------------------------------------------------
 
@@ -504,3 +2279,486 @@ class Backuper:
     #         f.write("\n".join([str(project_folder) for project_folder in project_folders_hdd]))
 
     # -------------------------------------------------------------------------
+
+
+# ------ WORKERS (module level to run in worker processes) ------
+
+def _scan_folders(root_project_folders):
+    """Returns compact state of files inside project folders (a task of the scan,
+    see Backuper._scan_project_folders).
+
+    Args:
+        root_project_folders (list): Tuples of absolute path to root folder (str) and
+          path to a project folder relative to it (str in posix format)
+    Returns:
+        list of scans of the project folders. Each scan is a tuple of folder paths
+        relative to root folder (list of str, each folder stored once), folder
+        indexes (array), names (list of str), sizes (array) and modification times
+        in nanoseconds (array) of files and duration of the scan in seconds
+    """
+    scans = []
+    for root_folder, project_folder in root_project_folders:
+        start = time.perf_counter()
+        folders, folder_indexes, names = [], array("L"), []
+        sizes, mtimes = array("q"), array("q")
+        for dir_path, _, file_names in os.walk(os.path.join(root_folder, project_folder)):
+            if not file_names:
+                continue
+            folder_indexes.extend([len(folders)] * len(file_names))
+            folders.append(Path(dir_path).relative_to(root_folder).as_posix())
+            for file_name in file_names:
+                stat = os.stat(os.path.join(dir_path, file_name))
+                names.append(file_name)
+                sizes.append(stat.st_size)
+                mtimes.append(stat.st_mtime_ns)
+        scans.append((folders, folder_indexes, names, sizes, mtimes, time.perf_counter() - start))
+    return scans
+
+
+def _hash_path(path, chunk_size, rate_limit=None):
+    """Returns SHA-256 hex digest of a file.
+
+    Args:
+        path (path-like object): Absolute path to the file
+        chunk_size (int): Number of bytes read at once
+        rate_limit (float): Optional. Maximum hashing rate in bytes per second
+    """
+    hash = hashlib.sha256()
+    start = time.monotonic()
+    n = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hash.update(chunk)
+            n += len(chunk)
+            if rate_limit:
+                delay = n / rate_limit - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+    return hash.hexdigest()
+
+
+def _copy_path(source, target, chunk_size):
+    """Copies a file with its metadata (as shutil.copy2), hashing its data while
+    they are read once.
+
+    Args:
+        source (path-like object): Absolute path to the source file
+        target (path-like object): Absolute path to the target file
+        chunk_size (int): Number of bytes read at once
+    Returns:
+        tuple of size (int), modification time of the target in ns (int) and SHA-256
+        hex digest (str) of the copied data
+    """
+    hash = hashlib.sha256()
+    size = 0
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        while chunk := source_file.read(chunk_size):
+            hash.update(chunk)
+            target_file.write(chunk)
+            size += len(chunk)
+    shutil.copystat(source, target)
+    return size, os.stat(target).st_mtime_ns, hash.hexdigest()
+
+
+class _HashingWriter:
+    """Writable file object wrapper hashing (SHA-256) and counting data written through it.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+
+def _hash_paths(paths, chunk_size, rate_limit=None):
+    """Returns SHA-256 hex digests and hashing durations of files (a task of
+    Backuper._hash_files, see _hash_path).
+    """
+    results = []
+    for path in paths:
+        start = time.perf_counter()
+        digest = _hash_path(path, chunk_size, rate_limit)
+        results.append((digest, time.perf_counter() - start))
+    return results
+
+
+def _map_bounded(executor, function, tasks, window):
+    """Generator like executor.map yielding results in order of the tasks, but
+    keeping at most window tasks submitted ahead, to bound memory of the results.
+
+    Args:
+        tasks (iterable): Tuples of arguments of the function
+    """
+    futures = deque()
+    for task in tasks:
+        futures.append(executor.submit(function, *task))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+# ------ SNAPSHOTS ------
+# Snapshots (and other .autogen files keyed by file paths, such as sync snapshot and
+# checksums) are compact binary files of records sorted by file paths relative to
+# root folder. A file starts with a header naming its format, followed by a record
+# per file: lengths of the path prefix shared with the previous path and of the rest
+# of the path (RECORD_PATH), the rest of the path (UTF-8) and fixed size columns of
+# the format. Records are read sequentially from the memory-mapped file, so that
+# memory does not depend on number of files.
+#
+# Tree snapshot (SNAPSHOT_HEADER) columns are size, modification time in ns and
+# SHA-256 digest (zeros if unknown). Sync snapshot (SYNC_SNAPSHOT_HEADER) columns
+# are size and modification time in ns on PC and on HDD (size -1 if missing).
+# Checksums (CHECKSUMS_HEADER) columns are size and SHA-256 digest.
+
+RECORD_PATH = struct.Struct("<HH")
+SNAPSHOT_HEADER = b"PBSNAP1\n"
+SNAPSHOT_COLUMNS = struct.Struct("<qq32s")
+SNAPSHOT_NO_DIGEST = bytes(32)
+SYNC_SNAPSHOT_HEADER = b"PBSYNC1\n"
+SYNC_SNAPSHOT_COLUMNS = struct.Struct("<qqqq")
+CHECKSUMS_HEADER = b"PBSUMS2\n"
+CHECKSUMS_COLUMNS = struct.Struct("<qq32s")
+
+
+class _RecordsWriter:
+    """Writes records sorted by their paths to a compact file (see SNAPSHOTS).
+
+    Args:
+        records_path (pathlib.Path): Path to the file
+        header (bytes): Header of the format
+        columns (struct.Struct): Columns of the format
+    """
+
+    def __init__(self, records_path, header, columns):
+        self._columns = columns
+        self._previous = b""
+        self._file = open(records_path, "wb")
+        self._file.write(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, path, *values):
+        """Writes a record of a file path relative to root folder (str in posix format)
+        and values of the columns.
+
+        Raises:
+            ValueError: if the path does not come after the previous path
+        """
+        encoded = path.encode("utf-8", "surrogateescape")
+        if self._previous and encoded <= self._previous:
+            raise ValueError(f"Records are not sorted: {path}")
+        shared = 0
+        limit = min(len(self._previous), len(encoded), 0xFFFF)
+        while shared < limit and self._previous[shared] == encoded[shared]:
+            shared += 1
+        self._file.write(RECORD_PATH.pack(shared, len(encoded) - shared))
+        self._file.write(encoded[shared:])
+        self._file.write(self._columns.pack(*values))
+        self._previous = encoded
+
+    def close(self):
+        self._file.close()
+
+
+def _read_records(records_path, header, columns):
+    """Generator reading records from a compact file (see _RecordsWriter).
+
+    Yields:
+        Tuples of file path relative to root folder (str in posix format) and
+        values of the columns
+    Raises:
+        ValueError: if the file does not start with the header
+    """
+    with open(records_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if m[:len(header)] != header:
+                raise ValueError(f"Unexpected format of {records_path}")
+            offset = len(header)
+            path = b""
+            while offset < len(m):
+                shared, length = RECORD_PATH.unpack_from(m, offset)
+                offset += RECORD_PATH.size
+                path = path[:shared] + m[offset:offset + length]
+                offset += length
+                values = columns.unpack_from(m, offset)
+                offset += columns.size
+                yield (path.decode("utf-8", "surrogateescape"), *values)
+
+
+class _RecordsMerge:
+    """Rewrites a compact file of records (see _RecordsWriter) in a single streaming
+    pass, replacing records of consecutive ranges of paths.
+
+    Ranges are given by path prefixes (e.g. of project folders) in increasing
+    order. Records before a range are copied as they are, records of the range
+    are handed over by take() to be written again (changed) by write().
+    close() copies the remaining records and replaces the file.
+
+    Args:
+        records_path (pathlib.Path): Path to the file (it may not exist yet)
+        header (bytes): Header of the format
+        columns (struct.Struct): Columns of the format
+    """
+
+    def __init__(self, records_path, header, columns):
+        self._records_path = records_path
+        self._new_path = records_path.with_suffix(".tmp")
+        self._records = None
+        self._record = None
+        if records_path.exists():
+            self._records = _read_records(records_path, header, columns)
+            self._record = next(self._records, None)
+        self._writer = _RecordsWriter(self._new_path, header, columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def take(self, prefix):
+        """Copies records before a path prefix and returns records starting with it.
+
+        Args:
+            prefix (str): Path prefix (in posix format), greater than previous prefixes
+        Returns:
+            list of records (tuples of path and values of the columns)
+        """
+        taken = []
+        while self._record is not None and self._record[0] < prefix:
+            self._writer.write(*self._record)
+            self._record = next(self._records, None)
+        while self._record is not None and self._record[0].startswith(prefix):
+            taken.append(self._record)
+            self._record = next(self._records, None)
+        return taken
+
+    def write(self, path, *values):
+        """Writes a record (see _RecordsWriter.write), after the taken records
+        are copied (see take).
+        """
+        self._writer.write(path, *values)
+
+    def close(self):
+        """Copies the remaining records and replaces the file with the rewritten one.
+        """
+        if self._writer is None:
+            return None
+        while self._record is not None:
+            self._writer.write(*self._record)
+            self._record = next(self._records, None)
+        self._writer.close()
+        self._writer = None
+        if self._records is not None:
+            self._records.close()
+        os.replace(self._new_path, self._records_path)
+
+
+class _RecordsCursor:
+    """Forward cursor over records sorted by paths (e.g. a generator of _read_records),
+    handing over consecutive ranges of paths given by prefixes in increasing order.
+
+    Args:
+        records (generator): Tuples of path and values, sorted by the paths
+    """
+
+    def __init__(self, records):
+        self._records = records
+        self._record = next(records, None)
+
+    def take(self, prefix):
+        """Skips records before a path prefix and returns records starting with it.
+
+        Args:
+            prefix (str): Path prefix (in posix format), greater than previous prefixes
+        Returns:
+            list of records (tuples of path and values)
+        """
+        taken = []
+        while self._record is not None and self._record[0] < prefix:
+            self._record = next(self._records, None)
+        while self._record is not None and self._record[0].startswith(prefix):
+            taken.append(self._record)
+            self._record = next(self._records, None)
+        return taken
+
+    def close(self):
+        """Closes the records (e.g. before their file is replaced).
+        """
+        self._records.close()
+
+
+class _SyncSnapshotMerge(_RecordsMerge):
+    """Rewrites the sync snapshot (see _RecordsMerge) by project folders, with
+    states of files on PC and HDD (tuples of size and mtime in ns, or None).
+
+    Args:
+        snapshot_path (pathlib.Path): Path to the sync snapshot file
+    """
+
+    def __init__(self, snapshot_path):
+        super().__init__(snapshot_path, SYNC_SNAPSHOT_HEADER, SYNC_SNAPSHOT_COLUMNS)
+
+    def take_project(self, project_folder):
+        """Returns sync snapshot of a project folder (see Backuper._read_sync_snapshot),
+        to be written again by write_states(). Project folders must be taken in
+        sorted order of their paths.
+
+        Args:
+            project_folder (pathlib.Path): Path to a project folder relative to root folder
+        """
+        return {path: _unpack_sync_states(values) for path, *values
+                in self.take(project_folder.as_posix() + "/")}
+
+    def write_states(self, path, pc, hdd):
+        """Writes states of a file on PC and HDD (in sorted order of the paths).
+        """
+        self.write(path, *_pack_sync_states(pc, hdd))
+
+
+def _pack_sync_states(pc, hdd):
+    """Returns columns of a sync snapshot record of file states on PC and HDD.
+    """
+    return (*(pc or (-1, 0)), *(hdd or (-1, 0)))
+
+
+def _unpack_sync_states(values):
+    """Returns file states on PC and HDD of columns of a sync snapshot record.
+    """
+    pc_size, pc_mtime, hdd_size, hdd_mtime = values
+    return (None if pc_size < 0 else (pc_size, pc_mtime),
+            None if hdd_size < 0 else (hdd_size, hdd_mtime))
+
+
+def _walk_project_files(root_folder, project_folders=None):
+    """Generator of states of files in project folders sorted by their paths.
+
+    Folders are walked depth-first with entries of each folder sorted so that
+    the paths come in the same order as sorted strings, keeping only the entries
+    of the current branch in memory. Location folders starting with "_" (such as
+    the utility folder) are skipped, as in Backuper._get_project_folders.
+
+    Args:
+        root_folder (pathlib.Path): Absolute path to root folder
+        project_folders (list): Optional. Paths to project folders relative to root
+          folder to walk, sorted by their paths. All project folders are walked if None.
+    Yields:
+        Tuples of file path relative to root folder (str in posix format), size (int),
+        modification time in nanoseconds (int) and digest (None)
+    """
+    def sorted_entries(folder):
+        with os.scandir(folder) as entries:
+            # "/" after folder names sorts them as paths of their files
+            return sorted(entries, key=lambda entry: entry.name + "/"
+                          if entry.is_dir(follow_symlinks=False) else entry.name)
+
+    def walk(folder, relative_folder):
+        for entry in sorted_entries(folder):
+            path = f"{relative_folder}/{entry.name}"
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path, path)
+            else:
+                stat = entry.stat(follow_symlinks=False)
+                yield path, stat.st_size, stat.st_mtime_ns, None
+
+    if project_folders is not None:
+        for project_folder in project_folders:
+            if (root_folder / project_folder).is_dir():
+                yield from walk(root_folder / project_folder, project_folder.as_posix())
+        return None
+    for location_folder in sorted_entries(root_folder):
+        if not location_folder.is_dir() or location_folder.name[0] == "_":
+            continue
+        for project_folder in sorted_entries(location_folder.path):
+            if project_folder.is_dir():
+                yield from walk(project_folder.path, f"{location_folder.name}/{project_folder.name}")
+
+
+def _write_snapshot(snapshot_path, entries):
+    """Generator writing states of files to a tree snapshot while passing them through.
+
+    Args:
+        snapshot_path (pathlib.Path): Path to the snapshot file
+        entries (iterable): Tuples of file path relative to root folder (str in
+          posix format), size, modification time in ns and digest (hex str or None),
+          sorted by the paths
+    Yields:
+        The entries, after writing them
+    Raises:
+        ValueError: if the entries are not sorted by their paths
+    """
+    with _RecordsWriter(snapshot_path, SNAPSHOT_HEADER, SNAPSHOT_COLUMNS) as writer:
+        for entry in entries:
+            path, size, mtime, digest = entry
+            writer.write(path, size, mtime, bytes.fromhex(digest) if digest else SNAPSHOT_NO_DIGEST)
+            yield entry
+
+
+def _read_snapshot(snapshot_path):
+    """Generator reading states of files from a tree snapshot (see _write_snapshot).
+
+    Args:
+        snapshot_path (pathlib.Path): Path to the snapshot file
+    Yields:
+        Tuples of file path relative to root folder (str in posix format), size (int),
+        modification time in nanoseconds (int) and digest (hex str or None)
+    """
+    for path, size, mtime, digest in _read_records(snapshot_path, SNAPSHOT_HEADER,
+                                                   SNAPSHOT_COLUMNS):
+        yield path, size, mtime, None if digest == SNAPSHOT_NO_DIGEST else digest.hex()
+
+
+def _merge_join(items1, items2, key):
+    """Generator pairing items of two iterables sorted by key, in a single pass.
+
+    Yields:
+        Tuples of an item of the first and the second iterable with equal keys,
+        with None in place of an item missing in one of them
+    """
+    items1, items2 = iter(items1), iter(items2)
+    item1, item2 = next(items1, None), next(items2, None)
+    while item1 is not None or item2 is not None:
+        if item2 is None or (item1 is not None and key(item1) < key(item2)):
+            yield item1, None
+            item1 = next(items1, None)
+        elif item1 is None or key(item2) < key(item1):
+            yield None, item2
+            item2 = next(items2, None)
+        else:
+            yield item1, item2
+            item1, item2 = next(items1, None), next(items2, None)
+
+
+def _diff_snapshots(old_entries, new_entries):
+    """Generator comparing two snapshots (e.g. of the last run and of today) by a
+    streaming merge-join in O(n) time and constant memory.
+
+    Files differ if their sizes, modification times (beyond the tolerance of
+    Backuper._same_file_state) or known digests differ.
+
+    Args:
+        old_entries (iterable): States of files sorted by paths (see _read_snapshot)
+        new_entries (iterable): States of files sorted by paths (see _read_snapshot)
+    Yields:
+        Tuples of change ("new", "changed" or "deleted") and file path relative to
+        root folder (str in posix format)
+    """
+    for old, new in _merge_join(old_entries, new_entries, key=lambda entry: entry[0]):
+        if old is None:
+            yield "new", new[0]
+        elif new is None:
+            yield "deleted", old[0]
+        elif (not Backuper._same_file_state(old[1:3], new[1:3])
+              or (old[3] and new[3] and old[3] != new[3])):
+            yield "changed", new[0]
@@ -3,35 +3,29 @@ import sys
 import os
 import threading
 import time
-import shutil # TODO: for testing
-from datetime import datetime
+import shutil
+import argparse
+import logging
 
-from flask import Flask, render_template, request
+from flask import Blueprint, Flask, Response, current_app, jsonify, render_template, request
 from flask_socketio import SocketIO
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, SelectField
-from wtforms.validators import InputRequired
-import sqlite3
+from wtforms import StringField, SubmitField, SelectField, FloatField
+from wtforms.validators import InputRequired, Optional
 from dotenv import load_dotenv
 
 from photo_backuper.backuper import Backuper
 
 # TODO: remove, but make it work even without photo_backuper package installed
 folder_path = Path(__file__).parents[0]
-sys.path.append(folder_path)
+sys.path.append(str(folder_path))
 
-app = Flask(__name__)
-load_dotenv()
-app.config['SECRET_KEY'] = os.environ.get('APP_KEY')
-socketio = SocketIO(app)
+from database import RunHistory, FileOperationsRecorder
+from metrics import Metrics
 
-# copy files for demonstration purposes
-demo_data = folder_path.parents[0] / r"data\IMAGES"
-demo_data_original = folder_path.parents[0] / r"data\IMAGES_original"
-shutil.rmtree(demo_data, ignore_errors=True)
-shutil.copytree(demo_data_original, demo_data)
-# shutil.rmtree(r"D:/initial_state" , ignore_errors=True)
-# shutil.copytree(r"D:/initial_state_original", r"D:/initial_state")
+socketio = SocketIO()
+bp = Blueprint("backuper", __name__)
+history_lock = threading.Lock()
 
 class InputForm(FlaskForm):
     mode_choices = [x for x in zip(Backuper.MODES, Backuper.MODES_NAMES)]
@@ -40,48 +34,57 @@ class InputForm(FlaskForm):
     utility_folder = StringField("Utility Folder", validators=[InputRequired("Utility folder required")])
     source_folder = StringField("Source Folder")
     target_folder = StringField("Target Folder")
+    pc_budget = FloatField("PC Budget (GB)", validators=[Optional()])
     run_button = SubmitField("Run Mode")
 
-def execute_query(db_path, query, *args):
-    '''Connect to database and execute query.
+
+def create_app(config=None, demo=False):
+    """Creates the web app. Nothing is done at import, so that startup stays fast.
+
     Args:
-        db_path: path-like object
-    '''
-    try:
-        with sqlite3.connect(db_path) as con:
-            cur = con.cursor()
-            cur.execute(query, args)
-            con.commit()
-            if query.strip().upper().startswith("SELECT"):
-                rows = cur.fetchall() # list of tuples
-                column_names = [desc[0] for desc in cur.description]
-                # list of dicts - each dict for one row
-                return [dict(zip(column_names, row)) for row in rows]
-            return None
-    except sqlite3.Error as e:
-         print(e)
-
-# create database
-db_path = folder_path / "logs.db"
-query = """
-CREATE TABLE IF NOT EXISTS logs (
-    id INTEGER PRIMARY KEY,
-    timestamp TEXT NOT NULL,
-    mode TEXT NOT NULL,
-    utility_folder TEXT NOT NULL,
-    source_folder TEXT NOT NULL,
-    target_folder TEXT NOT NULL
-)
-"""
-execute_query(db_path, query)
-
-
-@app.route("/", methods=["GET", "POST"])
+        config (dict): Optional. Flask configuration overriding the defaults
+          (e.g. DATABASE with path to the history database).
+        demo (bool): Copy made up data (data/IMAGES_original) to data/IMAGES
+          to demonstrate the app on them.
+    """
+    app = Flask(__name__)
+    load_dotenv()
+    app.config['SECRET_KEY'] = os.environ.get('APP_KEY')
+    app.config['DATABASE'] = folder_path / "logs.db"
+    if config:
+        app.config.update(config)
+    if demo:
+        seed_demo_data()
+    app.extensions["metrics"] = Metrics()
+    app.register_blueprint(bp)
+    socketio.init_app(app)
+    return app
+
+
+def seed_demo_data():
+    """Copies made up data for demonstration purposes.
+    """
+    demo_data = folder_path.parents[0] / "data" / "IMAGES"
+    demo_data_original = folder_path.parents[0] / "data" / "IMAGES_original"
+    shutil.rmtree(demo_data, ignore_errors=True)
+    shutil.copytree(demo_data_original, demo_data)
+
+
+def get_history():
+    """Returns database of history of runs of the app. It is opened on first use.
+    """
+    with history_lock:
+        if "run_history" not in current_app.extensions:
+            current_app.extensions["run_history"] = RunHistory(current_app.config["DATABASE"])
+    return current_app.extensions["run_history"]
+
+
+@bp.route("/", methods=["GET", "POST"])
 def index():
 
-    log_count = execute_query(db_path, "SELECT COUNT() FROM logs")[0]["COUNT()"]
-    if log_count:
-        last_log = execute_query(db_path, "SELECT * FROM logs WHERE id = (SELECT MAX(id) FROM logs) ")[0]
+    history = get_history()
+    last_log = history.get_last_run()
+    if last_log:
         input_form = InputForm(
             mode=last_log["mode"],
             utility_folder=last_log["utility_folder"],
@@ -97,24 +100,49 @@ def index():
         utility_folder = input_form.utility_folder.data # D:\\OBRÁZKY   C:/Python_notebooks/photo_backuper/data/IMAGES/source
         source_folder = input_form.source_folder.data   # D:\\OBRÁZKY   C:/Python_notebooks/photo_backuper/data/IMAGES/source
         target_folder = input_form.target_folder.data   # F:\\OBRÁZKY   C:/Python_notebooks/photo_backuper/data/IMAGES/target
+        pc_budget = input_form.pc_budget.data
         
         # mode-specific validation
         if mode != Backuper.MODES[0] and not (source_folder and target_folder):
             validation_message += "For selected mode, both source and target folders must be specified.\n"
+        elif mode == "pc_budget" and pc_budget is None:
+            validation_message += "For selected mode, PC budget must be specified.\n"
         else:
             # log history to database
-            timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-            query = """
-            INSERT INTO logs (timestamp, mode, utility_folder, source_folder, target_folder)
-            VALUES (?, ?, ?, ?, ?)
-            """
-            execute_query(db_path, query, timestamp, mode, utility_folder, source_folder, target_folder)
+            run_id = history.start_run(mode, utility_folder, source_folder, target_folder)
+            metrics = current_app.extensions["metrics"]
 
             # define backuper
             def run_backuper():
                 time.sleep(0.5) # delay to render template before logging any messages
 
-                backuper = Backuper(mode, utility_folder, source_folder, target_folder)
+                # several target folders (pool of drives) are separated by a semicolon
+                target_folders = [x.strip() for x in target_folder.split(";") if x.strip()]
+                if pc_budget is not None:
+                    pc_budget_bytes = int(pc_budget * 1024**3)
+                else:
+                    pc_budget_bytes = None
+                # record file operations of the run in batches and count them for metrics
+                recorder = FileOperationsRecorder(history, run_id)
+                def report_file_operation(*args):
+                    recorder(*args)
+                    metrics(*args)
+                backuper = Backuper(mode, utility_folder, source_folder, target_folders,
+                                    pc_budget=pc_budget_bytes,
+                                    file_operation_callback=report_file_operation)
+                metrics.track(backuper)
+                try:
+                    run_mode(backuper)
+                except Exception:
+                    recorder.flush()
+                    history.finish_run(run_id, status="failed")
+                    raise
+                finally:
+                    metrics.untrack(backuper)
+                recorder.flush()
+                history.finish_run(run_id)
+
+            def run_mode(backuper):
                 match mode:
                     case "initialize":
                         message = backuper.mode_initialize_settings()
@@ -133,6 +161,15 @@ def index():
                                       {'message':"Autogenerating lists of project folders with raw files..."})   
                         backuper.autogen_project_folders_with_raw()
                         socketio.emit('backup_message', {'message': "Backing up finished successfully."})
+                    case "pc_budget":
+                        for message in backuper.generator_manage_pc_budget():
+                            socketio.emit('backup_message', {'message': message})
+                        socketio.emit('backup_message',
+                                      {'message': "Managing PC storage budget finished successfully."})
+                    case "scrub":
+                        for message in backuper.generator_scrub_target():
+                            socketio.emit('backup_message', {'message': message})
+                        socketio.emit('backup_message', {'message': "Scrubbing finished successfully."})
 
             # call backuper and continuously log results
             thread = threading.Thread(target=run_backuper)
@@ -145,21 +182,59 @@ def index():
     return render_template("index.html", input_form=input_form, validation_message=validation_message)
 
 
-@app.route("/logs", methods=["GET", "POST"])
+@bp.route("/logs", methods=["GET", "POST"])
 def show_logs():
+    history = get_history()
     if request.method == "POST":
         log_id = request.form.get("log_id")
         delete_all = bool(request.form.get("delete_all"))
         if log_id:
-            execute_query(db_path, "DELETE FROM logs WHERE id = ?", log_id)
+            history.delete_run(log_id)
         elif delete_all:
-            execute_query(db_path, "DELETE FROM logs")
+            history.delete_all_runs()
+
+    # keyset pagination - show runs older than the given run id
+    before = request.args.get("before", type=int)
+    logs = history.get_runs(before_id=before)
+    older = logs[-1]["id"] if len(logs) == history.PAGE_SIZE else None
+
+    # when was a file last copied
+    file_path = request.args.get("file_path", "").strip()
+    last_operation = history.get_last_file_operation(file_path) if file_path else None
+
+    return render_template("logs.html", logs=logs, older=older, file_path=file_path,
+                           last_operation=last_operation)
+
+
+@bp.route("/metrics")
+def show_metrics():
+    metrics = current_app.extensions["metrics"]
+    return Response(metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/dashboard")
+def show_dashboard():
+    history = get_history().get_device_history()
+    return render_template("dashboard.html", history=history)
+
 
-    logs = execute_query(db_path, "SELECT * FROM logs")
-    
-    return render_template("logs.html", logs=logs)
+@bp.route("/dashboard/data")
+def dashboard_data():
+    metrics = current_app.extensions["metrics"]
+    rates = metrics.get_rates()
+    devices = []
+    for device, total in sorted(metrics.get_device_totals().items()):
+        rate = rates.get(device, {"files_per_s": 0.0, "bytes_per_s": 0.0})
+        devices.append({"device": device, **total, **rate,
+                        "last_scan_duration": metrics.last_scan_duration.get(device)})
+    return jsonify(queue_depth=metrics.get_queue_depth(), devices=devices)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--demo", default=False, action='store_true', help="Demo mode on made up data.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    app = create_app(demo=args.demo)
     app.run(debug=True)
 
@@ -0,0 +1,324 @@
+from contextlib import contextmanager
+from datetime import datetime
+import queue
+import sqlite3
+
+from photo_backuper.backuper import Backuper
+
+
+class RunHistory:
+    """Database of history of runs of the backuper.
+
+    Stores runs (mode and folders the backuper was run with), per project folder
+    and per device (root folder on a drive) results and per file operations
+    (copies, moves, deletions, scans, ...) with their sizes and durations. The
+    database is in WAL mode, so that writes of a running backup do not block
+    reading the history. Connections are kept in a pool shared by all threads
+    (the backup thread and a new thread per request), so that they are not
+    opened again for each request.
+
+    Args:
+        db_path (path-like object): Path to the SQLite database file.
+        pool_size (int): Maximum number of idle connections kept open.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        timestamp TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        utility_folder TEXT NOT NULL,
+        source_folder TEXT NOT NULL,
+        target_folder TEXT NOT NULL,
+        finished TEXT,
+        status TEXT NOT NULL DEFAULT 'running',
+        files INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        duration REAL NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS project_results (
+        id INTEGER PRIMARY KEY,
+        run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+        project_folder TEXT NOT NULL,
+        files INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        duration REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS file_operations (
+        id INTEGER PRIMARY KEY,
+        run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+        timestamp TEXT NOT NULL,
+        operation TEXT NOT NULL,
+        device TEXT NOT NULL,
+        project_folder TEXT NOT NULL,
+        path TEXT NOT NULL,
+        bytes INTEGER NOT NULL,
+        duration REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS device_results (
+        id INTEGER PRIMARY KEY,
+        run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+        device TEXT NOT NULL,
+        operation TEXT NOT NULL,
+        files INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        duration REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS project_results_run ON project_results (run_id);
+    CREATE INDEX IF NOT EXISTS device_results_run ON device_results (run_id);
+    CREATE INDEX IF NOT EXISTS project_results_project ON project_results (project_folder, run_id);
+    CREATE INDEX IF NOT EXISTS file_operations_run ON file_operations (run_id);
+    CREATE INDEX IF NOT EXISTS file_operations_path ON file_operations (path, id);
+    """
+
+    PAGE_SIZE = 50
+    POOL_SIZE = 4
+    ERROR_OPERATIONS = tuple(Backuper.ERROR_OPERATIONS)
+    # operations not counted as processed files in per project folder results
+    UNCOUNTED_OPERATIONS = ("scan", *ERROR_OPERATIONS)
+    # operations not counted in throughput of devices
+    NON_TRANSFER_OPERATIONS = ("scan", "delete", "delete_pc", *ERROR_OPERATIONS)
+
+    def __init__(self, db_path, pool_size=POOL_SIZE):
+        self.db_path = db_path
+        self._idle_connections = queue.LifoQueue(maxsize=pool_size)
+        self.create_schema()
+
+    def _connect(self):
+        """Opens a new connection to the database.
+        """
+        # connections are used by one thread at a time, but not always the same one
+        con = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode = WAL")
+        con.execute("PRAGMA synchronous = NORMAL")
+        con.execute("PRAGMA foreign_keys = ON")
+        return con
+
+    @contextmanager
+    def connection(self):
+        """Context manager lending a connection from the pool. An idle connection
+        is reused, a new one is opened only if there is none. Connections returned
+        to a full pool are closed.
+        """
+        try:
+            con = self._idle_connections.get_nowait()
+        except queue.Empty:
+            con = self._connect()
+        try:
+            yield con
+        finally:
+            if con.in_transaction:
+                con.rollback()
+            try:
+                self._idle_connections.put_nowait(con)
+            except queue.Full:
+                con.close()
+
+    def close(self):
+        """Closes idle connections of the pool.
+        """
+        while True:
+            try:
+                self._idle_connections.get_nowait().close()
+            except queue.Empty:
+                return None
+
+    def query(self, query, *args):
+        """Executes a SELECT query and returns the rows as a list of dicts.
+        """
+        with self.connection() as con:
+            rows = con.execute(query, args).fetchall()
+        return [dict(row) for row in rows]
+
+    def execute(self, query, *args):
+        """Executes a modifying query in a transaction and returns id of the last inserted row.
+        """
+        with self.connection() as con, con:
+            return con.execute(query, args).lastrowid
+
+    def create_schema(self):
+        """Creates tables and indexes. Migrates history from the former logs table.
+        """
+        with self.connection() as con, con:
+            con.executescript(self.SCHEMA)
+            logs_table = con.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'logs'").fetchone()
+            if logs_table:
+                con.execute("""
+                    INSERT INTO runs (id, timestamp, mode, utility_folder, source_folder,
+                                      target_folder, status)
+                    SELECT id, timestamp, mode, utility_folder, source_folder, target_folder,
+                           'unknown'
+                    FROM logs
+                """)
+                con.execute("DROP TABLE logs")
+
+    # ------ RUNS ------
+
+    def start_run(self, mode, utility_folder, source_folder, target_folder):
+        """Inserts a new run and returns its id.
+        """
+        timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        return self.execute("""
+            INSERT INTO runs (timestamp, mode, utility_folder, source_folder, target_folder)
+            VALUES (?, ?, ?, ?, ?)
+        """, timestamp, mode, utility_folder, source_folder, target_folder)
+
+    def finish_run(self, run_id, status="finished"):
+        """Marks a run as finished and stores its per project folder and per device
+        results and totals.
+        """
+        finished = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        uncounted = ", ".join("?" * len(self.UNCOUNTED_OPERATIONS))
+        with self.connection() as con, con:
+            con.execute(f"""
+                INSERT INTO project_results (run_id, project_folder, files, bytes, duration)
+                SELECT run_id, project_folder, COUNT(*), SUM(bytes), SUM(duration)
+                FROM file_operations WHERE run_id = ? AND operation NOT IN ({uncounted})
+                GROUP BY project_folder
+            """, (run_id, *self.UNCOUNTED_OPERATIONS))
+            con.execute("""
+                INSERT INTO device_results (run_id, device, operation, files, bytes, duration)
+                SELECT run_id, device, operation, COUNT(*), SUM(bytes), SUM(duration)
+                FROM file_operations WHERE run_id = ?
+                GROUP BY device, operation
+            """, (run_id,))
+            con.execute("""
+                UPDATE runs SET finished = ?, status = ?,
+                    files = (SELECT COALESCE(SUM(files), 0) FROM project_results WHERE run_id = ?),
+                    bytes = (SELECT COALESCE(SUM(bytes), 0) FROM project_results WHERE run_id = ?),
+                    duration = (SELECT COALESCE(SUM(duration), 0) FROM project_results WHERE run_id = ?)
+                WHERE id = ?
+            """, (finished, status, run_id, run_id, run_id, run_id))
+
+    def get_last_run(self):
+        """Returns the last run as a dict, or None if there are no runs.
+        """
+        rows = self.query("SELECT * FROM runs ORDER BY id DESC LIMIT 1")
+        return rows[0] if rows else None
+
+    def get_runs(self, before_id=None, limit=PAGE_SIZE):
+        """Returns a page of runs from the newest, using keyset pagination.
+
+        Args:
+            before_id (int): Optional. Return only runs older than the run with this id.
+            limit (int): Maximum number of returned runs.
+        Returns:
+            list of runs as dicts
+        """
+        if before_id is None:
+            return self.query("SELECT * FROM runs ORDER BY id DESC LIMIT ?", limit)
+        return self.query("SELECT * FROM runs WHERE id < ? ORDER BY id DESC LIMIT ?",
+                          before_id, limit)
+
+    def get_project_results(self, run_id):
+        """Returns per project folder results of a run.
+        """
+        return self.query("""
+            SELECT * FROM project_results WHERE run_id = ? ORDER BY project_folder
+        """, run_id)
+
+    def get_device_history(self, limit=PAGE_SIZE):
+        """Returns per device results of the last finished runs, from the newest.
+
+        Args:
+            limit (int): Maximum number of runs.
+        Returns:
+            list of dicts with run id, timestamp, device, transferred files and bytes,
+            transfer duration, scanned bytes, scan duration and number of errors
+        """
+        non_transfer = ", ".join("?" * len(self.NON_TRANSFER_OPERATIONS))
+        errors = ", ".join("?" * len(self.ERROR_OPERATIONS))
+        return self.query(f"""
+            SELECT runs.id AS run_id, runs.timestamp, device,
+                SUM(CASE WHEN operation NOT IN ({non_transfer}) THEN files ELSE 0 END) AS files,
+                SUM(CASE WHEN operation NOT IN ({non_transfer}) THEN bytes ELSE 0 END) AS bytes,
+                SUM(CASE WHEN operation NOT IN ({non_transfer}) THEN duration ELSE 0 END) AS duration,
+                SUM(CASE WHEN operation = 'scan' THEN bytes ELSE 0 END) AS scan_bytes,
+                SUM(CASE WHEN operation = 'scan' THEN duration ELSE 0 END) AS scan_duration,
+                SUM(CASE WHEN operation IN ({errors}) THEN files ELSE 0 END) AS errors
+            FROM (SELECT id, timestamp FROM runs WHERE finished IS NOT NULL
+                  ORDER BY id DESC LIMIT ?) AS runs
+            JOIN device_results ON device_results.run_id = runs.id
+            GROUP BY runs.id, device
+            ORDER BY runs.id DESC, device
+        """, *self.NON_TRANSFER_OPERATIONS, *self.NON_TRANSFER_OPERATIONS,
+             *self.NON_TRANSFER_OPERATIONS, *self.ERROR_OPERATIONS, limit)
+
+    def delete_run(self, run_id):
+        """Deletes a run with its results and file operations.
+        """
+        self.execute("DELETE FROM runs WHERE id = ?", run_id)
+
+    def delete_all_runs(self):
+        """Deletes all runs with their results and file operations.
+        """
+        self.execute("DELETE FROM runs")
+
+    # ------ FILE OPERATIONS ------
+
+    def record_file_operations(self, run_id, operations):
+        """Inserts file operations of a run in a single transaction.
+
+        Args:
+            run_id (int): Id of the run.
+            operations (list): tuples of timestamp, operation, device, project folder,
+              file path, size in bytes and duration in seconds (see
+              Backuper.file_operation_callback)
+        """
+        if not operations:
+            return None
+        with self.connection() as con, con:
+            con.executemany("""
+                INSERT INTO file_operations (run_id, timestamp, operation, device,
+                                             project_folder, path, bytes, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(run_id, *operation) for operation in operations])
+
+    def get_last_file_operation(self, path, operations=("copy", "move", "pack")):
+        """Returns the last operation of given types on a file (e.g. when it was last
+        copied), or None if there is no such operation.
+
+        Args:
+            path (str): File path relative to root folder in posix format.
+            operations (tuple): Types of operations to search for.
+        """
+        placeholders = ", ".join("?" * len(operations))
+        rows = self.query(f"""
+            SELECT file_operations.*, runs.mode, runs.source_folder
+            FROM file_operations JOIN runs ON runs.id = file_operations.run_id
+            WHERE path = ? AND operation IN ({placeholders})
+            ORDER BY file_operations.id DESC LIMIT 1
+        """, path, *operations)
+        return rows[0] if rows else None
+
+
+class FileOperationsRecorder:
+    """Callable buffering file operations reported by Backuper (see
+    Backuper.file_operation_callback) and writing them to RunHistory in batches.
+
+    Args:
+        history (RunHistory): Database of history of runs.
+        run_id (int): Id of the run the operations belong to.
+        batch_size (int): Number of buffered operations written in a single transaction.
+    """
+
+    def __init__(self, history, run_id, batch_size=500):
+        self.history = history
+        self.run_id = run_id
+        self.batch_size = batch_size
+        self.operations = []
+
+    def __call__(self, operation, device, project_folder, path, size, duration):
+        timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        self.operations.append((timestamp, operation, device, project_folder, path, size,
+                                duration))
+        if len(self.operations) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered operations to the database.
+        """
+        self.history.record_file_operations(self.run_id, self.operations)
+        self.operations = []
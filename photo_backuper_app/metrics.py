@@ -0,0 +1,140 @@
+from collections import deque
+import threading
+import time
+
+from photo_backuper.backuper import Backuper
+from database import RunHistory
+
+
+class Metrics:
+    """Live counters of file operations per device (root folder on a drive).
+
+    Callable as Backuper.file_operation_callback, it only adds to counters under
+    a lock, so that the overhead per file stays negligible. Counters accumulate
+    over all runs since start of the app, as expected by Prometheus. Current
+    throughput is computed from samples of the counters taken when read.
+    """
+
+    NON_TRANSFER_OPERATIONS = RunHistory.NON_TRANSFER_OPERATIONS
+    ERROR_OPERATIONS = Backuper.ERROR_OPERATIONS
+    RATE_WINDOW = 10 # seconds
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {} # (device, operation) -> [files, bytes, seconds]
+        self.last_scan_duration = {} # device -> seconds
+        self.backupers = []
+        self._samples = deque()
+
+    def __call__(self, operation, device, project_folder, path, size, duration):
+        with self._lock:
+            counter = self.counters.get((device, operation))
+            if counter is None:
+                counter = self.counters[(device, operation)] = [0, 0, 0.0]
+            counter[0] += 1
+            counter[1] += size
+            counter[2] += duration
+            if operation == "scan":
+                self.last_scan_duration[device] = duration
+
+    def track(self, backuper):
+        """Starts reading queue depth of a running backuper.
+        """
+        with self._lock:
+            self.backupers.append(backuper)
+
+    def untrack(self, backuper):
+        """Stops reading queue depth of a finished backuper.
+        """
+        with self._lock:
+            self.backupers.remove(backuper)
+
+    def get_queue_depth(self):
+        """Returns number of project folders left to process by running backupers.
+        """
+        with self._lock:
+            return sum(backuper.queue_depth for backuper in self.backupers)
+
+    def get_device_totals(self):
+        """Returns totals of transferred files and bytes, errors and scan duration per device.
+
+        Returns:
+            dict of device to dict with files, bytes, duration, errors and scan_duration
+        """
+        totals = {}
+        with self._lock:
+            for (device, operation), (files, size, duration) in self.counters.items():
+                total = totals.setdefault(device, {"files": 0, "bytes": 0, "duration": 0.0,
+                                                   "errors": 0, "scan_duration": 0.0})
+                if operation in self.ERROR_OPERATIONS:
+                    total["errors"] += files
+                elif operation == "scan":
+                    total["scan_duration"] += duration
+                if operation not in self.NON_TRANSFER_OPERATIONS:
+                    total["files"] += files
+                    total["bytes"] += size
+                    total["duration"] += duration
+        return totals
+
+    def get_rates(self):
+        """Returns current throughput per device over the last RATE_WINDOW seconds.
+
+        Returns:
+            dict of device to dict with files_per_s and bytes_per_s
+        """
+        now = time.monotonic()
+        totals = self.get_device_totals()
+        with self._lock:
+            self._samples.append((now, totals))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= self.RATE_WINDOW:
+                self._samples.popleft()
+            sample_time, sample_totals = self._samples[0]
+        elapsed = now - sample_time
+        rates = {}
+        for device, total in totals.items():
+            previous = sample_totals.get(device, {"files": 0, "bytes": 0})
+            rates[device] = {
+                "files_per_s": (total["files"] - previous["files"]) / elapsed if elapsed else 0.0,
+                "bytes_per_s": (total["bytes"] - previous["bytes"]) / elapsed if elapsed else 0.0,
+            }
+        return rates
+
+    def to_prometheus(self):
+        """Returns the metrics in Prometheus text exposition format.
+        """
+        lines = []
+        def add_metric(name, type, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(label)}"'
+                                      for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        with self._lock:
+            counters = sorted((key, list(counter)) for key, counter in self.counters.items())
+            last_scan_duration = sorted(self.last_scan_duration.items())
+        for index, (suffix, help) in enumerate((
+                ("file_operations_total", "Number of file operations."),
+                ("bytes_total", "Bytes processed by file operations."),
+                ("operation_seconds_total", "Time spent in file operations."))):
+            add_metric(f"photo_backuper_{suffix}", "counter", help,
+                       [({"device": device, "operation": operation}, counter[index])
+                        for (device, operation), counter in counters])
+        add_metric("photo_backuper_errors_total", "counter",
+                   "Failed file operations, corrupt and missing files.",
+                   [({"device": device}, total["errors"])
+                    for device, total in sorted(self.get_device_totals().items())])
+        add_metric("photo_backuper_last_scan_seconds", "gauge",
+                   "Duration of the last scan of a project folder.",
+                   [({"device": device}, duration) for device, duration in last_scan_duration])
+        add_metric("photo_backuper_queue_depth", "gauge",
+                   "Project folders left to process by running backups.",
+                   [({}, self.get_queue_depth())])
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    """Escapes a label value for Prometheus text format (e.g. backslashes of Windows paths).
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -3,10 +3,15 @@ Run with $ python -m unittest test/test_backuper.py
 '''
 
 import unittest
+from unittest import mock
 import tempfile
 import os
 import shutil
+import time
+import hashlib
+from pathlib import Path
 
+from photo_backuper import backuper as backuper_module
 from photo_backuper.backuper import Backuper
 
 class TestModeSelection(unittest.TestCase):
@@ -75,6 +80,30 @@ class TestModeBackupNewFolders(unittest.TestCase):
         # test both source and target folders are as expected
         self.assertTrue(_compare_folders(self.expected_final_state, self.tempdir))
 
+    def test_file_operation_callback(self):
+        '''Reporting of file operations performed while backing up'''
+        operations = []
+        def callback(operation, device, project_folder, path, size, duration):
+            operations.append((operation, device, project_folder, path, size, duration))
+        utility_root = os.path.join(self.tempdir, "source")
+        source_folder= os.path.join(self.tempdir, "source")
+        target_folder = os.path.join(self.tempdir, "target")
+        backuper = Backuper(self.mode, utility_root, source_folder, target_folder,
+                            file_operation_callback=callback)
+        backuper.perform_current_mode()
+
+        self.assertTrue(operations)
+        for operation, device, project_folder, path, size, duration in operations:
+            self.assertIn(operation, ["copy", "move"])
+            self.assertEqual(device, target_folder)
+            self.assertTrue(path.startswith(project_folder + "/"))
+            self.assertGreaterEqual(size, 0)
+            self.assertGreaterEqual(duration, 0)
+        # every copied file exists on target
+        for operation, _, _, path, _, _ in operations:
+            if operation == "copy":
+                self.assertTrue(os.path.isfile(os.path.join(target_folder, path)))
+
     # TODO: add edge cases:
     # - source and target does not exist
     # - no new project folders
@@ -105,9 +134,833 @@ class TestModeBackupModifiedFolders(unittest.TestCase):
         self.assertTrue(_compare_folders(self.expected_final_state, self.tempdir))
 
 
+class TestReconcileModifiedFolders(unittest.TestCase):
+
+    def setUp(self):
+        self.mode = Backuper.MODES[2] # "modified_folders"
+        self.tempdir = tempfile.mkdtemp()
+        self.initial_state = os.path.join(os.path.dirname(__file__), "data_backup_modified", "initial_state")
+        shutil.copytree(self.initial_state, self.tempdir, dirs_exist_ok=True)
+        self.source_folder = os.path.join(self.tempdir, "source")
+        self.target_folder = os.path.join(self.tempdir, "target")
+        self.project_folder = Path("Alpy", "2020.99.99 Modified folder")
+        self.pc = os.path.join(self.source_folder, self.project_folder)
+        self.hdd = os.path.join(self.target_folder, self.project_folder)
+
+        # first sync creates the sync snapshot
+        self.backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder)
+        self.backuper.perform_current_mode()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _list_modified(self, filename):
+        self.backuper._write_project_folders_list(filename, [self.project_folder])
+
+    def test_modified_on_hdd_keeps_raw_on_hdd(self):
+        '''Changes on HDD are propagated to PC, raw files stay on HDD'''
+        with open(os.path.join(self.hdd, "výběr lq", "P8223541.jpg"), "w") as f:
+            f.write("edited on HDD")
+        with open(os.path.join(self.hdd, "P3554.orf"), "w") as f:
+            f.write("raw")
+        os.remove(os.path.join(self.hdd, "P2554.orf"))
+        self._list_modified(Backuper.FILENAME_PROJECTS_MODIFIED_HDD)
+        self.backuper.perform_current_mode()
+
+        with open(os.path.join(self.pc, "výběr lq", "P8223541.jpg")) as f:
+            self.assertEqual(f.read(), "edited on HDD")
+        self.assertEqual(os.listdir(self.pc), ["výběr lq"])
+        self.assertEqual(sorted(os.listdir(self.hdd)), ["P3554.orf", "tiffs", "výběr lq"])
+        self.assertEqual(self.backuper._read_project_folders_list(
+            Backuper.FILENAME_PROJECTS_MODIFIED_HDD, self.backuper.target_folder), [])
+
+    def test_modified_on_pc_keeps_unchanged_raw(self):
+        '''Changes on PC are propagated to HDD without deleting raw files kept on HDD'''
+        os.remove(os.path.join(self.pc, "výběr lq", "P8223541.jpg"))
+        with open(os.path.join(self.pc, "výběr lq", "P8223542.jpg"), "w") as f:
+            f.write("exported on PC")
+        self._list_modified(Backuper.FILENAME_PROJECTS_MODIFIED_PC)
+        self.backuper.perform_current_mode()
+
+        self.assertEqual(os.listdir(os.path.join(self.hdd, "výběr lq")), ["P8223542.jpg"])
+        self.assertEqual(sorted(os.listdir(self.hdd)), ["P2554.orf", "tiffs", "výběr lq"])
+
+    def test_only_emptied_folders_removed(self):
+        '''Folders emptied by deletions are removed, empty folders of the user are kept'''
+        os.mkdir(os.path.join(self.pc, "exports"))
+        selection = os.path.join(self.pc, "výběr lq")
+        for name in os.listdir(selection):
+            os.remove(os.path.join(selection, name))
+        self._list_modified(Backuper.FILENAME_PROJECTS_MODIFIED_PC)
+        self.backuper.perform_current_mode()
+
+        self.assertFalse(os.path.exists(os.path.join(self.hdd, "výběr lq")))
+        self.assertTrue(os.path.isdir(os.path.join(self.pc, "exports")))
+        self.assertTrue(os.path.isdir(selection))
+
+    def test_conflict(self):
+        '''Files changed on both PC and HDD are reported and left untouched'''
+        path = os.path.join("výběr lq", "P8223541.jpg")
+        with open(os.path.join(self.pc, path), "w") as f:
+            f.write("edited on PC")
+        with open(os.path.join(self.hdd, path), "w") as f:
+            f.write("edited on HDD!")
+        self._list_modified(Backuper.FILENAME_PROJECTS_MODIFIED_PC)
+        messages = list(self.backuper.generator_backup_modified_folders())
+
+        conflict = (self.project_folder / path).as_posix()
+        self.assertIn(f"Conflict (changed on both PC and HDD): {conflict}", messages)
+        with open(os.path.join(self.hdd, path)) as f:
+            self.assertEqual(f.read(), "edited on HDD!")
+        with open(self.backuper.autogen_folder / Backuper.FILENAME_SYNC_CONFLICTS, encoding="utf-8") as f:
+            self.assertEqual(f.read(), conflict)
+        self.assertEqual(self.backuper._read_project_folders_list(
+            Backuper.FILENAME_PROJECTS_MODIFIED_PC, self.backuper.source_folder), [self.project_folder])
+
+    def test_evicted_raw_kept_on_hdd(self):
+        '''Raw files evicted from PC by pc_budget mode are not deleted from HDD'''
+        project_folder = Path("Alpy", "2023.9.9 Hochschwab")
+        Backuper("new_folders", self.source_folder, self.source_folder,
+                 self.target_folder).perform_current_mode()
+        budget_backuper = Backuper("pc_budget", self.source_folder, self.source_folder,
+                                   self.target_folder, pc_budget=0)
+        budget_backuper.perform_current_mode()
+
+        self.backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_MODIFIED_PC, [project_folder])
+        self.backuper.perform_current_mode()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.target_folder, project_folder))),
+                         ["P5534.orf", "P5574.orf", "itinerář.txt", "tiffs", "výběr lq"])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.source_folder, project_folder))),
+                         ["itinerář.txt", "výběr lq"])
+
+
+class TestFirstReconciliation(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.initial_state = os.path.join(os.path.dirname(__file__), "data_backup_new", "initial_state")
+        shutil.copytree(self.initial_state, self.tempdir, dirs_exist_ok=True)
+        self.source_folder = os.path.join(self.tempdir, "source")
+        self.target_folder = os.path.join(self.tempdir, "target")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_first_sync_after_new_folders(self):
+        '''First sync of project folders backed up by new_folders keeps raw data moved to HDD'''
+        Backuper("new_folders", self.source_folder, self.source_folder,
+                 self.target_folder).perform_current_mode()
+        old_project = Path("Alpy", "2023.8.18 Hochschwab sever")
+        new_project = Path("Bílé Karpaty", "2022.12.11 Lesná, Porážky")
+        with open(os.path.join(self.source_folder, old_project, "fb", "P8223541.jpg"), "w") as f:
+            f.write("edited on PC")
+        os.remove(os.path.join(self.source_folder, new_project, "fb", "PC111304.jpg"))
+
+        backuper = Backuper("modified_folders", self.source_folder, self.source_folder, self.target_folder)
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_MODIFIED_PC,
+                                             [old_project, new_project])
+        backuper.perform_current_mode()
+
+        old_target = os.path.join(self.target_folder, old_project)
+        self.assertEqual(sorted(os.listdir(old_target)), ["P1554.orf", "P2554.orf", "cesta.txt", "fb"])
+        with open(os.path.join(old_target, "fb", "P8223541.jpg")) as f:
+            self.assertEqual(f.read(), "edited on PC")
+        new_target = os.path.join(self.target_folder, new_project)
+        self.assertEqual(sorted(os.listdir(new_target)), ["P554.orf", "fb", "tiffs"])
+        self.assertEqual(os.listdir(os.path.join(new_target, "fb")), ["PC111303.jpg"])
+        self.assertEqual(backuper._read_project_folders_list(
+            Backuper.FILENAME_PROJECTS_MODIFIED_PC, backuper.source_folder), [])
+
+    def test_first_sync_keeps_checksums(self):
+        '''Checksums recorded by new_folders survive the first sync of unchanged files'''
+        backuper = Backuper("modified_folders", self.source_folder, self.source_folder, self.target_folder)
+        Backuper("new_folders", self.source_folder, self.source_folder,
+                 self.target_folder).perform_current_mode()
+        project = Path("Alpy", "2023.9.9 Hochschwab")
+        prefix = project.as_posix() + "/"
+        stored = [path for path, _ in backuper._read_checksums() if path.startswith(prefix)]
+        self.assertIn(f"{prefix}P5534.orf", stored)
+        with open(os.path.join(self.source_folder, project, "itinerář.txt"), "a") as f:
+            f.write("edited on PC\n")
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_MODIFIED_PC, [project])
+        backuper.perform_current_mode()
+
+        checksums = {path: checksum for path, checksum in backuper._read_checksums()
+                     if path.startswith(prefix)}
+        self.assertEqual(sorted(checksums), stored)
+        self.assertEqual(checksums[f"{prefix}itinerář.txt"][0],
+                         os.path.getsize(os.path.join(self.target_folder, project, "itinerář.txt")))
+
+    def test_modifications_consumed(self):
+        '''Synced project folders modified on PC since the last run are reconciled without being listed'''
+        Backuper("new_folders", self.source_folder, self.source_folder,
+                 self.target_folder).perform_current_mode()
+        backuper = Backuper("modified_folders", self.source_folder, self.source_folder, self.target_folder)
+        # raw data moved by new_folders are not listed, backed up project folders are removed
+        self.assertEqual(backuper._read_modifications(), {})
+        # digests of files on PC come from checksums recorded when copying them
+        project = Path("Bílé Karpaty", "2022.12.11 Lesná, Porážky")
+        snapshot = {path: digest for path, _, _, digest in backuper_module._read_snapshot(
+            backuper.autogen_folder / Backuper.FILENAME_TREE_SNAPSHOT)}
+        with open(os.path.join(self.source_folder, project, "fb", "PC111303.jpg"), "rb") as f:
+            self.assertEqual(snapshot[(project / "fb" / "PC111303.jpg").as_posix()],
+                             hashlib.sha256(f.read()).hexdigest())
+
+        # the first sync is listed by the user
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_MODIFIED_PC, [project])
+        backuper.perform_current_mode()
+        with open(os.path.join(self.source_folder, project, "fb", "PC111303.jpg"), "w") as f:
+            f.write("edited on PC")
+        messages = list(backuper.generator_backup_modified_folders())
+        self.assertIn(f"Backing up modified folder  1/1: {project} (1 actions)", messages)
+        with open(os.path.join(self.target_folder, project, "fb", "PC111303.jpg")) as f:
+            self.assertEqual(f.read(), "edited on PC")
+        self.assertEqual(backuper._read_modifications(), {})
+        backuper.autogen_modifications()
+        self.assertEqual(backuper._read_modifications(), {})
+
+        # files on PC touched since copying them have no digest
+        path = os.path.join(self.source_folder, project, "fb", "PC111303.jpg")
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns + 10 * 10**9))
+        backuper.autogen_modifications()
+        snapshot = {path: digest for path, _, _, digest in backuper_module._read_snapshot(
+            backuper.autogen_folder / Backuper.FILENAME_TREE_SNAPSHOT)}
+        self.assertIsNone(snapshot[(project / "fb" / "PC111303.jpg").as_posix()])
+
+    def test_never_synced_modifications_kept(self):
+        '''Project folders never synced are not mirrored from PC unless listed by the user'''
+        Backuper("new_folders", self.source_folder, self.source_folder,
+                 self.target_folder).perform_current_mode()
+        project = Path("Bílé Karpaty", "2022.12.11 Lesná, Porážky")
+        only_on_hdd = os.path.join(self.target_folder, project, "fb", "only_on_hdd.jpg")
+        with open(only_on_hdd, "w") as f:
+            f.write("added on HDD")
+        with open(os.path.join(self.source_folder, project, "fb", "PC111303.jpg"), "w") as f:
+            f.write("edited on PC")
+
+        backuper = Backuper("modified_folders", self.source_folder, self.source_folder, self.target_folder)
+        messages = list(backuper.generator_backup_modified_folders())
+        self.assertEqual(messages, ["No modified project folders found."])
+        self.assertTrue(os.path.isfile(only_on_hdd))
+        self.assertEqual(list(backuper._read_modifications()), [project])
+
+
+class TestTargetDrivesPool(unittest.TestCase):
+
+    def setUp(self):
+        self.mode = Backuper.MODES[1] # "new_folders"
+        self.tempdir = tempfile.mkdtemp()
+        self.initial_state = os.path.join(os.path.dirname(__file__), "data_backup_new", "initial_state")
+        shutil.copytree(self.initial_state, self.tempdir, dirs_exist_ok=True)
+        self.source_folder = os.path.join(self.tempdir, "source")
+        self.target_folders = [os.path.join(self.tempdir, "target"),
+                               os.path.join(self.tempdir, "target_2")]
+        os.mkdir(self.target_folders[1])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _disk_usage(self, free_spaces):
+        """Returns mock of shutil.disk_usage with given free space per target folder"""
+        def disk_usage(path):
+            free = free_spaces[self.target_folders.index(str(path))]
+            return shutil._ntuple_diskusage(2 * free, free, free)
+        return disk_usage
+
+    def test_most_free_placement(self):
+        '''New project folders are placed on the drive with the most free space'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folders)
+        free_spaces = [Backuper.FREE_SPACE_RESERVE + 10, Backuper.FREE_SPACE_RESERVE + 100]
+        with mock.patch("shutil.disk_usage", self._disk_usage(free_spaces)):
+            backuper.perform_current_mode()
+
+        new_project = Path("Alpy", "2023.9.9 Hochschwab")
+        self.assertTrue(os.path.exists(os.path.join(self.target_folders[1], new_project)))
+        self.assertFalse(os.path.exists(os.path.join(self.target_folders[0], new_project)))
+
+        # existing project folder is indexed on the first drive, new ones on the second
+        self.assertEqual(backuper._resolve_root(backuper.target_folder, Path("Alpy", "2023.8.18 Hochschwab sever")),
+                         Path(self.target_folders[0]))
+        self.assertEqual(backuper._resolve_root(backuper.target_folder, new_project), Path(self.target_folders[1]))
+
+        # utility folder with the index is backed up to all drives
+        for target_folder in self.target_folders:
+            self.assertTrue(os.path.exists(os.path.join(
+                target_folder, "_photo_backuper", ".autogen", Backuper.FILENAME_LOCATION_INDEX)))
+
+    def test_index_lookup(self):
+        '''Project folders on the drives are looked up in the index on the next run'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folders)
+        free_spaces = [Backuper.FREE_SPACE_RESERVE + 100, Backuper.FREE_SPACE_RESERVE + 100]
+        with mock.patch("shutil.disk_usage", self._disk_usage(free_spaces)):
+            backuper.perform_current_mode()
+
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folders)
+        with mock.patch.object(backuper, "_get_project_folders", wraps=backuper._get_project_folders) as scan:
+            messages = list(backuper.generator_backup_new_folders())
+        self.assertEqual(messages[-1], f"No new project folders found in {self.source_folder}.")
+        scanned = [call.args[0] for call in scan.call_args_list]
+        self.assertEqual(scanned, [Path(self.source_folder)])
+
+    def test_drive_remounted(self):
+        '''Project folders are found on a drive mounted under another path'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folders)
+        free_spaces = [Backuper.FREE_SPACE_RESERVE + 10, Backuper.FREE_SPACE_RESERVE + 100]
+        with mock.patch("shutil.disk_usage", self._disk_usage(free_spaces)):
+            backuper.perform_current_mode()
+
+        new_project = Path("Alpy", "2023.9.9 Hochschwab")
+        remounted = os.path.join(self.tempdir, "target_remounted")
+        os.rename(self.target_folders[1], remounted)
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder,
+                            [self.target_folders[0], remounted])
+        self.assertEqual(backuper._resolve_root(backuper.target_folder, new_project), Path(remounted))
+        messages = list(backuper.generator_backup_new_folders())
+        self.assertEqual(messages[-1], f"No new project folders found in {self.source_folder}.")
+
+        # drive which is not connected
+        other_drive = os.path.join(self.tempdir, "target_3")
+        os.mkdir(other_drive)
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder,
+                            [self.target_folders[0], other_drive])
+        self.assertFalse(backuper._is_connected(new_project))
+        with self.assertRaises(FileNotFoundError):
+            backuper._resolve_root(backuper.target_folder, new_project)
+
+    def test_not_enough_free_space(self):
+        '''Project folders not fitting on any drive are skipped'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folders,
+                            placement_policy="fill_first")
+        free_spaces = [Backuper.FREE_SPACE_RESERVE, Backuper.FREE_SPACE_RESERVE]
+        with mock.patch("shutil.disk_usage", self._disk_usage(free_spaces)):
+            messages = list(backuper.generator_backup_new_folders())
+        self.assertTrue(all("not enough free space" in msg for msg in messages[1:]))
+        self.assertEqual(os.listdir(self.target_folders[1]), ["_photo_backuper"])
+
+    def test_invalid_placement_policy(self):
+        '''Selection of an invalid placement policy'''
+        with self.assertRaises(ValueError):
+            Backuper(self.mode, self.source_folder, self.source_folder, self.target_folders,
+                     placement_policy="invalid_policy")
+
+
+class TestModeManagePCBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.mode = Backuper.MODES[3] # "pc_budget"
+        self.tempdir = tempfile.mkdtemp()
+        self.initial_state = os.path.join(os.path.dirname(__file__), "data_backup_new", "initial_state")
+        shutil.copytree(self.initial_state, self.tempdir, dirs_exist_ok=True)
+        self.source_folder = os.path.join(self.tempdir, "source")
+        self.target_folder = os.path.join(self.tempdir, "target")
+        self.old_project = Path("Alpy", "2023.9.9 Hochschwab")
+        self.new_project = Path("Bílé Karpaty", "2022.12.11 Lesná, Porážky")
+        for dir_path, _, file_names in os.walk(os.path.join(self.source_folder, self.old_project)):
+            for file_name in file_names:
+                os.utime(os.path.join(dir_path, file_name), (1000, 1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _backup_keeping_raw(self):
+        """Backs up new project folders keeping their raw data on PC"""
+        backuper = Backuper("new_folders", self.source_folder, self.source_folder, self.target_folder)
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_WITH_RAW,
+                                             [self.old_project, self.new_project])
+        backuper.perform_current_mode()
+
+    def test_evict_least_recently_used(self):
+        '''Raw data of the least recently used project folder are evicted to target'''
+        self._backup_keeping_raw()
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            pc_budget=3)
+        with mock.patch.object(backuper_module, "send2trash") as send2trash:
+            backuper.perform_current_mode()
+        # verified raw data are deleted permanently to free the space on PC
+        send2trash.assert_not_called()
+
+        source = os.path.join(self.source_folder, self.old_project)
+        target = os.path.join(self.target_folder, self.old_project)
+        self.assertEqual(sorted(os.listdir(source)), ["itinerář.txt", "výběr lq"])
+        self.assertEqual(sorted(os.listdir(target)),
+                         ["P5534.orf", "P5574.orf", "itinerář.txt", "tiffs", "výběr lq"])
+        self.assertTrue(os.path.exists(os.path.join(self.source_folder, self.new_project, "P554.orf")))
+
+        projects_with_raw = backuper._read_project_folders_list(
+            Backuper.FILENAME_PROJECTS_WITH_RAW, backuper.source_folder)
+        self.assertEqual(projects_with_raw, [self.new_project])
+
+    def test_not_backed_up_kept(self):
+        '''Raw data of project folders not backed up yet are never evicted'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            pc_budget=0)
+        messages = list(backuper.generator_manage_pc_budget())
+        self.assertIn(f"Raw data of {self.old_project} kept on PC, the project folder is not "
+                      "backed up in the target folder (run new_folders mode first)", messages)
+        self.assertFalse(os.path.exists(os.path.join(self.target_folder, self.old_project)))
+
+        # the whole project folder is backed up by new_folders mode afterwards
+        Backuper("new_folders", self.source_folder, self.source_folder, self.target_folder).perform_current_mode()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.target_folder, self.old_project))),
+                         ["P5534.orf", "P5574.orf", "itinerář.txt", "tiffs", "výběr lq"])
+
+    def test_evict_verified_by_digest(self):
+        '''Raw data differing from their backup of the same size are kept on PC'''
+        with open(os.path.join(self.source_folder, self.old_project, "P5534.orf"), "w") as f:
+            f.write("raw data")
+        os.utime(os.path.join(self.source_folder, self.old_project, "P5534.orf"), (1000, 1000))
+        self._backup_keeping_raw()
+        with open(os.path.join(self.target_folder, self.old_project, "P5534.orf"), "w") as f:
+            f.write("bit rot!")
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            pc_budget=3)
+        messages = list(backuper.generator_manage_pc_budget())
+        target = os.path.join(self.target_folder, self.old_project)
+        self.assertIn(f"Raw data of {self.old_project} not verified in {target}, kept on PC", messages)
+        self.assertTrue(os.path.exists(os.path.join(self.source_folder, self.old_project, "P5534.orf")))
+
+    def test_restore_project_to_be_processed(self):
+        '''Raw data of a project folder to be processed are restored from target'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            pc_budget=1024**3)
+        reopened_project = Path("Alpy", "2023.8.18 Hochschwab sever")
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_TO_BE_PROCESSED,
+                                             [reopened_project])
+        messages = list(backuper.generator_manage_pc_budget())
+
+        self.assertIn(f"Restored raw data of {reopened_project} (2 items)", messages)
+        source = os.path.join(self.source_folder, reopened_project)
+        self.assertTrue(os.path.exists(os.path.join(source, "P1554.orf")))
+        self.assertTrue(os.path.exists(os.path.join(source, "P2554.orf")))
+        self.assertIn(reopened_project, backuper._read_access_times())
+
+    def test_missing_pc_budget(self):
+        '''Running pc_budget mode without a budget'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder)
+        with self.assertRaises(ValueError):
+            backuper.perform_current_mode()
+
+
+class TestModeScrubTarget(unittest.TestCase):
+
+    def setUp(self):
+        self.mode = Backuper.MODES[4] # "scrub"
+        self.tempdir = tempfile.mkdtemp()
+        self.initial_state = os.path.join(os.path.dirname(__file__), "data_backup_new", "final_state")
+        shutil.copytree(self.initial_state, self.tempdir, dirs_exist_ok=True)
+        self.source_folder = os.path.join(self.tempdir, "source")
+        self.target_folder = os.path.join(self.tempdir, "target")
+        self.project_folder = os.path.join("Alpy", "2023.8.18 Hochschwab sever")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_scrub_corrupt_and_missing_files(self):
+        '''Corrupt and missing files are reported and repaired from source if possible'''
+        with open(os.path.join(self.target_folder, self.project_folder, "P1554.orf"), "w") as f:
+            f.write("raw data")
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            scrub_days=1)
+        backuper.perform_current_mode()
+        self.assertEqual(backuper._read_scrub_cursor(), "")
+        self.assertEqual(len(list(backuper._read_checksums())), len(list(backuper._iter_target_files())))
+
+        # corrupt a file with a good copy in source, a file without it and remove another one
+        cesta = os.path.join(self.target_folder, self.project_folder, "cesta.txt")
+        _simulate_bit_rot(cesta, b"rot")
+        _simulate_bit_rot(os.path.join(self.target_folder, self.project_folder, "P1554.orf"),
+                          b"bit rots")
+        os.remove(os.path.join(self.target_folder, self.project_folder, "P2554.orf"))
+
+        operations = []
+        backuper.file_operation_callback = lambda *args: operations.append(args)
+        with mock.patch.object(backuper_module, "send2trash",
+                               wraps=backuper_module.send2trash) as send2trash:
+            messages = list(backuper.generator_scrub_target())
+        project = Path(self.project_folder).as_posix()
+        self.assertIn(f"Scrubbed file repaired: {project}/cesta.txt", messages)
+        self.assertIn(f"Scrubbed file corrupt: {project}/P1554.orf", messages)
+        self.assertIn(f"Scrubbed file missing: {project}/P2554.orf", messages)
+        with open(cesta) as f:
+            self.assertNotEqual(f.read(), "rot")
+        # the corrupt file is not overwritten in place
+        send2trash.assert_called_once_with(Path(cesta))
+        with open(backuper.autogen_folder / Backuper.FILENAME_SCRUB_REPORT) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+        # errors are reported per device for metrics
+        errors = sorted((operation, device, path) for operation, device, _, path, _, _ in operations
+                        if operation in Backuper.ERROR_OPERATIONS)
+        self.assertEqual(errors, [("corrupt", self.target_folder, f"{project}/P1554.orf"),
+                                  ("corrupt", self.target_folder, f"{project}/cesta.txt"),
+                                  ("missing", self.target_folder, f"{project}/P2554.orf")])
+        self.assertIn("verify", [operation for operation, *_ in operations])
+
+    def test_checksums_recorded_at_copy_time(self):
+        '''Files copied to target are verified by the first scrub against their source'''
+        path = os.path.join(self.project_folder, "cesta.txt")
+        with open(os.path.join(self.source_folder, path), "w") as f:
+            f.write("edited on PC")
+        backuper = Backuper("modified_folders", self.source_folder, self.source_folder,
+                            self.target_folder, scrub_days=1)
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_MODIFIED_PC,
+                                             [Path(self.project_folder)])
+        backuper.perform_current_mode()
+        checksums = dict(backuper._read_checksums())
+        self.assertEqual(checksums[Path(path).as_posix()][0], len("edited on PC"))
+
+        _simulate_bit_rot(os.path.join(self.target_folder, path), b"bit rot on H")
+        messages = list(backuper.generator_scrub_target())
+        self.assertIn(f"Scrubbed file repaired: {Path(path).as_posix()}", messages)
+
+    def test_edited_on_hdd_not_repaired(self):
+        '''Files edited on HDD since their checksums were recorded are not corrupt'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            scrub_days=1)
+        backuper.perform_current_mode()
+        path = os.path.join(self.target_folder, self.project_folder, "cesta.txt")
+        with open(path, "w") as f:
+            f.write("edited on HDD")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 * 10**9))
+
+        messages = list(backuper.generator_scrub_target())
+        self.assertEqual(messages[-1], f"Scrubbed {0:.1f} MB, 0 problems found.")
+        with open(path) as f:
+            self.assertEqual(f.read(), "edited on HDD")
+        checksums = dict(backuper._read_checksums())
+        self.assertEqual(checksums[Path(self.project_folder, "cesta.txt").as_posix()][0],
+                         len("edited on HDD"))
+
+    def test_changed_on_hdd_not_corrupt(self):
+        '''Checksums of files edited on HDD and reconciled are recorded again'''
+        backuper = Backuper("modified_folders", self.source_folder, self.source_folder,
+                            self.target_folder, scrub_days=1)
+        list(backuper.generator_scrub_target())
+        with open(os.path.join(self.target_folder, self.project_folder, "cesta.txt"), "w") as f:
+            f.write("edited on HDD")
+        os.remove(os.path.join(self.target_folder, self.project_folder, "fb", "P8223541.jpg"))
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_MODIFIED_HDD,
+                                             [Path(self.project_folder)])
+        backuper.perform_current_mode()
+
+        messages = list(backuper.generator_scrub_target())
+        self.assertEqual(messages[-1], f"Scrubbed {0:.1f} MB, 0 problems found.")
+
+    def test_scrub_interrupted(self):
+        '''Stored checksums are kept and progress is saved when a scrub gets interrupted'''
+        path = os.path.join(self.project_folder, "P1554.orf")
+        with open(os.path.join(self.target_folder, path), "w") as f:
+            f.write("raw data")
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            scrub_days=1)
+        backuper.perform_current_mode()
+        checksums = list(backuper._read_checksums())
+        _simulate_bit_rot(os.path.join(self.target_folder, path), b"bit rots")
+
+        backuper.VERIFY_BATCH_FILES = 2
+        messages = backuper.generator_scrub_target()
+        self.assertEqual(next(messages)[:9], "Scrubbing")
+        self.assertEqual(next(messages), f"Scrubbed file corrupt: {Path(path).as_posix()}")
+        messages.close()
+        self.assertEqual(list(backuper._read_checksums()), checksums)
+        self.assertEqual(backuper._read_scrub_cursor(), Path(path).as_posix())
+
+    def test_scrub_resumes(self):
+        '''Each run scrubs a slice of files continuing where the last run stopped'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            scrub_days=1000)
+        paths = [path for path, *_ in backuper._iter_target_files()]
+        cursors = []
+        while not cursors or cursors[-1]:
+            list(backuper.generator_scrub_target())
+            cursors.append(backuper._read_scrub_cursor())
+            self.assertEqual(len(list(backuper._read_checksums())), paths.index(cursors[-1]) + 1
+                             if cursors[-1] else len(paths))
+
+        # several runs needed, each continuing after the last one
+        self.assertGreater(len(cursors), 2)
+        self.assertEqual(cursors[:-1], sorted(set(cursors[:-1])))
+
+
+class TestProcessPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.initial_state = os.path.join(os.path.dirname(__file__), "data_backup_new", "final_state")
+        shutil.copytree(self.initial_state, self.tempdir, dirs_exist_ok=True)
+        self.source_folder = os.path.join(self.tempdir, "source")
+        self.target_folder = os.path.join(self.tempdir, "target")
+        self.project_folder = os.path.join("Alpy", "2023.8.18 Hochschwab sever")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_scan_same_as_single_process(self):
+        '''Scanning in a process pool gives the same states of files'''
+        backuper = Backuper("scrub", self.source_folder, self.source_folder, self.target_folder)
+        pool_backuper = Backuper("scrub", self.source_folder, self.source_folder, self.target_folder,
+                                 scan_workers=2)
+        expected = list(backuper._iter_target_files())
+        self.assertTrue(expected)
+        self.assertEqual([path for path, *_ in expected], sorted(path for path, *_ in expected))
+        self.assertEqual(list(pool_backuper._iter_target_files()), expected)
+
+        root_project_folders = [(Path(self.source_folder), project_folder) for project_folder
+                                in backuper._get_project_folders(Path(self.source_folder))]
+        # results come in the given order, tasks are split across root folders
+        root_project_folders += [(Path(self.target_folder), project_folder) for _, project_folder
+                                 in root_project_folders]
+        self.assertEqual(list(pool_backuper._scan_project_folders(iter(root_project_folders))),
+                         list(backuper._scan_project_folders(root_project_folders)))
+
+    def test_scrub_in_process_pool(self):
+        '''Scrubbing with scanning and hashing in a process pool finds corrupt files'''
+        raw_file = os.path.join(self.target_folder, self.project_folder, "P1554.orf")
+        with open(raw_file, "w") as f:
+            f.write("raw data")
+        backuper = Backuper("scrub", self.source_folder, self.source_folder, self.target_folder,
+                            scrub_days=1, scan_workers=2, verify_workers=2)
+        backuper.perform_current_mode()
+        self.assertEqual(backuper._read_scrub_cursor(), "")
+        self.assertEqual(len(list(backuper._read_checksums())), len(list(backuper._iter_target_files())))
+
+        _simulate_bit_rot(raw_file, b"bit rots")
+        messages = list(backuper.generator_scrub_target())
+        project = Path(self.project_folder).as_posix()
+        self.assertIn(f"Scrubbed file corrupt: {project}/P1554.orf", messages)
+
+    def test_invalid_number_of_workers(self):
+        '''Number of workers must be at least 1'''
+        with self.assertRaises(ValueError):
+            Backuper("scrub", self.source_folder, self.source_folder, self.target_folder,
+                     verify_workers=0)
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.initial_state = os.path.join(os.path.dirname(__file__), "data_backup_new", "final_state")
+        shutil.copytree(self.initial_state, self.tempdir, dirs_exist_ok=True)
+        self.source_folder = os.path.join(self.tempdir, "source")
+        self.project_folder = os.path.join("Alpy", "2023.9.9 Hochschwab")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_snapshot_round_trip(self):
+        '''Snapshot keeps sorted paths and their columns with prefix compression'''
+        entries = [("Alpy/2023.9.9 Hochschwab/a.jpg", 10, 1, None),
+                   ("Alpy/2023.9.9 Hochschwab/výběr lq/b.jpg", 20, 2, "ab" * 32),
+                   ("Alpy/2023.9.9 Hochschwab/výběr lq/c.jpg", 30, 3, None)]
+        snapshot_path = Path(self.tempdir, "snapshot.bin")
+        self.assertEqual(list(backuper_module._write_snapshot(snapshot_path, entries)), entries)
+        self.assertEqual(list(backuper_module._read_snapshot(snapshot_path)), entries)
+        self.assertLess(snapshot_path.stat().st_size,
+                        sum(len(path.encode()) + 48 for path, *_ in entries))
+
+        with self.assertRaises(ValueError):
+            list(backuper_module._write_snapshot(snapshot_path, entries[::-1]))
+
+    def test_records_merge(self):
+        '''Records of a range of paths are replaced in a single streaming pass'''
+        records_path = Path(self.tempdir, "sync_snapshot.bin")
+        states = {"a/b/1": ((1, 10), None), "a/c/1": ((2, 20), (2, 21)),
+                  "a/c/2": (None, (3, 30)), "a/d/1": ((4, 40), (4, 40))}
+        with backuper_module._SyncSnapshotMerge(records_path) as merge:
+            for path, (pc, hdd) in states.items():
+                merge.write_states(path, pc, hdd)
+        with backuper_module._SyncSnapshotMerge(records_path) as merge:
+            self.assertEqual(merge.take_project(Path("a", "c")),
+                             {"a/c/1": states["a/c/1"], "a/c/2": states["a/c/2"]})
+            merge.write_states("a/c/3", (5, 50), None)
+            self.assertEqual(merge.take_project(Path("a", "x")), {})
+        backuper = Backuper("modified_folders", self.source_folder, self.source_folder,
+                            os.path.join(self.tempdir, "target"))
+        backuper.autogen_folder = Path(self.tempdir)
+        self.assertEqual(list(backuper._read_sync_snapshot()),
+                         [("a/b/1", states["a/b/1"]), ("a/c/3", ((5, 50), None)),
+                          ("a/d/1", states["a/d/1"])])
+
+    def test_walk_sorted_and_diff(self):
+        '''Files are walked in sorted order and differences are found by a merge-join'''
+        os.makedirs(os.path.join(self.source_folder, "Alpy", "2023.9.9 Hochschwab x"))
+        entries = list(backuper_module._walk_project_files(Path(self.source_folder)))
+        paths = [path for path, *_ in entries]
+        self.assertEqual(paths, sorted(paths))
+        self.assertIn(f"{Path(self.project_folder).as_posix()}/itinerář.txt", paths)
+        self.assertFalse([path for path in paths if path.startswith("_")])
+
+        old = [("a/b/deleted", 1, 0, None), ("a/b/same", 1, 0, None),
+               ("a/b/touched", 1, 0, None), ("a/b/rotten", 1, 0, "00" * 32)]
+        new = [("a/b/new", 1, 0, None), ("a/b/same", 1, 10**9, None),
+               ("a/b/touched", 2, 0, None), ("a/b/rotten", 1, 0, "11" * 32)]
+        self.assertEqual(list(backuper_module._diff_snapshots(sorted(old), sorted(new))),
+                         [("deleted", "a/b/deleted"), ("new", "a/b/new"),
+                          ("changed", "a/b/rotten"), ("changed", "a/b/touched")])
+
+    def test_autogen_modifications(self):
+        '''Project folders modified on PC since the last run are listed'''
+        backuper = Backuper("new_folders", self.source_folder, self.source_folder,
+                            os.path.join(self.tempdir, "target"))
+        list_path = backuper.autogen_folder / Backuper.FILENAME_MODIFICATIONS
+        backuper.autogen_modifications()
+        with open(list_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "")
+
+        project = os.path.join(self.source_folder, self.project_folder)
+        with open(os.path.join(project, "new.txt"), "w") as f:
+            f.write("new")
+        with open(os.path.join(project, "itinerář.txt"), "a") as f:
+            f.write("changed")
+        os.remove(os.path.join(project, "výběr lq", "P8227541.jpg"))
+        backuper.autogen_modifications()
+        with open(list_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), f"{Path(self.project_folder).as_posix()}\t1\t1\t1\n")
+
+        # the snapshot is updated by each run, numbers add up until backed up
+        backuper.autogen_modifications()
+        with open(list_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), f"{Path(self.project_folder).as_posix()}\t1\t1\t1\n")
+        os.remove(os.path.join(project, "new.txt"))
+        backuper.autogen_modifications()
+        with open(list_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), f"{Path(self.project_folder).as_posix()}\t1\t1\t2\n")
+
+
+class TestContainerMode(unittest.TestCase):
+
+    LATENCY = 0.005 # seconds per opened file on simulated network target
+
+    def setUp(self):
+        self.mode = Backuper.MODES[1] # "new_folders"
+        self.tempdir = tempfile.mkdtemp()
+        self.initial_state = os.path.join(os.path.dirname(__file__), "data_backup_new", "initial_state")
+        shutil.copytree(self.initial_state, self.tempdir, dirs_exist_ok=True)
+        self.source_folder = os.path.join(self.tempdir, "source")
+        self.target_folder = os.path.join(self.tempdir, "target")
+        self.project_folder = Path("Bílé Karpaty", "2022.12.11 Lesná, Porážky")
+        os.mkdir(os.path.join(self.source_folder, self.project_folder, "web"))
+        for i in range(40):
+            with open(os.path.join(self.source_folder, self.project_folder, "web", f"{i:03}.jpg"), "w") as f:
+                f.write(f"small file {i}")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _simulate_latency(self):
+        """Returns patch of open() sleeping and counting opened files inside project folders
+        in target folder"""
+        self.target_opens = 0
+        builtin_open = open
+        utility_folder = os.path.join(self.target_folder, "_" + Backuper.PROGRAM_NAME)
+        def latency_open(file, *args, **kwargs):
+            if (isinstance(file, (str, Path)) and str(file).startswith(self.target_folder)
+                and not str(file).startswith(utility_folder)):
+                self.target_opens += 1
+                time.sleep(self.LATENCY)
+            return builtin_open(file, *args, **kwargs)
+        return mock.patch("builtins.open", latency_open)
+
+    def test_container_backup_and_restore(self):
+        '''Small files are packed into a container, raw files are moved as plain files'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            container_mode=True)
+        list(backuper.generator_backup_new_folders())
+
+        target = os.path.join(self.target_folder, self.project_folder)
+        self.assertEqual(sorted(os.listdir(target)), ["P554.orf", Backuper.CONTAINER_INDEX_NAME,
+                                                      Backuper.CONTAINER_NAME, "tiffs"])
+        files = backuper.list_container_files(self.project_folder)
+        self.assertEqual(len(files), 42)
+        self.assertIn("web/007.jpg", files)
+
+        destination = os.path.join(self.tempdir, "restored")
+        n = backuper.restore_container_files(self.project_folder, destination, ["web/007.jpg"])
+        self.assertEqual(n, 1)
+        with open(os.path.join(destination, "web", "007.jpg")) as f:
+            self.assertEqual(f.read(), "small file 7")
+
+    def test_compressed_container_restore(self):
+        '''All files are restored from a compressed container'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            container_mode=True, container_compression="gz")
+        list(backuper.generator_backup_new_folders())
+
+        destination = os.path.join(self.tempdir, "restored")
+        n = backuper.restore_container_files(self.project_folder, destination)
+        self.assertEqual(n, 42)
+        self.assertTrue(_compare_folders(os.path.join(self.source_folder, self.project_folder), destination))
+
+    def test_modified_folder_repacked(self):
+        '''Containers unpacked to reconcile a modified project folder are packed again'''
+        backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                            container_mode=True)
+        backuper.perform_current_mode()
+        with open(os.path.join(self.source_folder, self.project_folder, "web", "007.jpg"), "w") as f:
+            f.write("edited on PC, longer")
+
+        backuper = Backuper("modified_folders", self.source_folder, self.source_folder,
+                            self.target_folder, container_mode=True)
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_MODIFIED_PC, [self.project_folder])
+        backuper.perform_current_mode()
+        target = os.path.join(self.target_folder, self.project_folder)
+        self.assertEqual(sorted(os.listdir(target)), ["P554.orf", Backuper.CONTAINER_INDEX_NAME,
+                                                      Backuper.CONTAINER_NAME, "tiffs"])
+        destination = os.path.join(self.tempdir, "restored")
+        backuper.restore_container_files(self.project_folder, destination, ["web/007.jpg"])
+        with open(os.path.join(destination, "web", "007.jpg")) as f:
+            self.assertEqual(f.read(), "edited on PC, longer")
+
+        # packed files are not considered changed by the next sync
+        backuper._write_project_folders_list(Backuper.FILENAME_PROJECTS_MODIFIED_HDD, [self.project_folder])
+        messages = list(backuper.generator_backup_modified_folders())
+        self.assertIn(f"Backing up modified folder  1/1: {self.project_folder} (0 actions)",
+                      messages)
+
+        # checksums of the repacked container are recorded, not reported as corrupt or missing
+        backuper.scrub_days = 1
+        messages = list(backuper.generator_scrub_target())
+        self.assertTrue(messages[-1].endswith(" 0 problems found."), messages)
+
+    def test_latency_target(self):
+        '''Container mode opens far fewer files on a target with per-operation latency'''
+        results = {}
+        for container_mode in (False, True):
+            shutil.rmtree(self.tempdir)
+            self.setUp()
+            backuper = Backuper(self.mode, self.source_folder, self.source_folder, self.target_folder,
+                                container_mode=container_mode)
+            with self._simulate_latency():
+                start = time.monotonic()
+                list(backuper.generator_backup_new_folders())
+                results[container_mode] = (self.target_opens, time.monotonic() - start)
+
+        self.assertLess(results[True][0] * 5, results[False][0])
+        self.assertLess(results[True][1], results[False][1])
+
+
 # TODO test autogen methods
 
 
+def _simulate_bit_rot(path, data):
+    '''Overwrites a file with data of the same size, keeping its modification time'''
+    stat = os.stat(path)
+    assert len(data) == stat.st_size
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def _listdir_expected(folder):
+    '''Lists a folder without binary files generated to .autogen folder (snapshots
+    and checksums), which fixtures do not keep'''
+    names = os.listdir(folder)
+    if os.path.basename(folder) == ".autogen":
+        names = [name for name in names if not name.endswith(".bin")]
+    return names
+
+
 def _compare_folders(folder1, folder2):
         """Compare the contents of two folders.
         
@@ -117,8 +970,8 @@ def _compare_folders(folder1, folder2):
             folder1 (str): path to the first folder
             folder2 (str): path to the second folder
         """
-        contents1 = os.listdir(folder1)
-        contents2 = os.listdir(folder2)
+        contents1 = _listdir_expected(folder1)
+        contents2 = _listdir_expected(folder2)
 
         contents1.sort()
         contents2.sort()
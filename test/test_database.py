@@ -0,0 +1,171 @@
+'''
+Run with $ python -m unittest test/test_database.py
+'''
+
+import unittest
+import tempfile
+import os
+import shutil
+import sqlite3
+import threading
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parents[1] / "photo_backuper_app"))
+
+from database import RunHistory, FileOperationsRecorder
+
+
+class TestRunHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tempdir, "logs.db")
+        self.history = RunHistory(self.db_path)
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.tempdir)
+
+    def _start_run(self, mode="new_folders"):
+        return self.history.start_run(mode, "/utility", "/source", "/target")
+
+    def _record(self, run_id, *operations):
+        self.history.record_file_operations(run_id, [
+            ("2024/01/01 00:00:00", operation, "/target", "Alpy/Project", path, size, 0.5)
+            for operation, path, size in operations])
+
+    def test_keyset_pagination(self):
+        '''Runs are paged from the newest by id of the last run of the previous page'''
+        run_ids = [self._start_run() for _ in range(5)]
+        page = self.history.get_runs(limit=2)
+        self.assertEqual([run["id"] for run in page], run_ids[:2:-1])
+        page = self.history.get_runs(before_id=page[-1]["id"], limit=2)
+        self.assertEqual([run["id"] for run in page], run_ids[2:0:-1])
+        page = self.history.get_runs(before_id=page[-1]["id"], limit=2)
+        self.assertEqual([run["id"] for run in page], run_ids[:1])
+        self.assertEqual(self.history.get_runs(before_id=run_ids[0]), [])
+        self.assertEqual(self.history.get_last_run()["id"], run_ids[-1])
+
+    def test_finish_run(self):
+        '''Results of a run count transferred files only'''
+        run_id = self._start_run()
+        self._record(run_id, ("copy", "Alpy/Project/a.jpg", 10), ("move", "Alpy/Project/b.orf", 20),
+                     ("scan", "Alpy/Project", 30), ("error", "Alpy/Project/c.jpg", 0))
+        self.history.finish_run(run_id)
+
+        run = self.history.get_last_run()
+        self.assertEqual((run["status"], run["files"], run["bytes"]), ("finished", 2, 30))
+        self.assertEqual([(result["project_folder"], result["files"])
+                          for result in self.history.get_project_results(run_id)],
+                         [("Alpy/Project", 2)])
+        device, = self.history.get_device_history()
+        self.assertEqual((device["files"], device["bytes"], device["scan_bytes"], device["errors"]),
+                         (2, 30, 30, 1))
+
+    def test_get_last_file_operation(self):
+        '''The last copy of a file is found with the run it belongs to'''
+        first_run = self._start_run("new_folders")
+        self._record(first_run, ("copy", "Alpy/Project/a.jpg", 10))
+        second_run = self._start_run("modified_folders")
+        self._record(second_run, ("copy", "Alpy/Project/a.jpg", 11),
+                     ("delete", "Alpy/Project/a.jpg", 11))
+
+        operation = self.history.get_last_file_operation("Alpy/Project/a.jpg")
+        self.assertEqual((operation["run_id"], operation["mode"], operation["bytes"]),
+                         (second_run, "modified_folders", 11))
+        operation = self.history.get_last_file_operation("Alpy/Project/a.jpg", ("delete",))
+        self.assertEqual(operation["operation"], "delete")
+        self.assertIsNone(self.history.get_last_file_operation("Alpy/Project/b.jpg"))
+
+    def test_delete_run_cascades(self):
+        '''Deleting a run deletes its results and file operations'''
+        run_ids = [self._start_run() for _ in range(2)]
+        for run_id in run_ids:
+            self._record(run_id, ("copy", "Alpy/Project/a.jpg", 10))
+            self.history.finish_run(run_id)
+
+        self.history.delete_run(run_ids[0])
+        for table in ("file_operations", "project_results", "device_results"):
+            rows = self.history.query(f"SELECT run_id FROM {table}")
+            self.assertEqual([row["run_id"] for row in rows], run_ids[1:], table)
+        self.history.delete_all_runs()
+        for table in ("runs", "file_operations", "project_results", "device_results"):
+            self.assertEqual(self.history.query(f"SELECT * FROM {table}"), [], table)
+
+    def test_logs_migration(self):
+        '''Runs stored in the former logs table are kept'''
+        self.history.close()
+        os.remove(self.db_path)
+        with sqlite3.connect(self.db_path) as con:
+            con.execute("""
+                CREATE TABLE logs (
+                    id INTEGER PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    utility_folder TEXT NOT NULL,
+                    source_folder TEXT NOT NULL,
+                    target_folder TEXT NOT NULL
+                )
+            """)
+            con.execute("INSERT INTO logs VALUES (7, '2023/01/01 00:00:00', 'new_folders', "
+                        "'/utility', '/source', '/target')")
+        con.close()
+
+        self.history = RunHistory(self.db_path)
+        run, = self.history.get_runs()
+        self.assertEqual((run["id"], run["mode"], run["status"]), (7, "new_folders", "unknown"))
+        self.assertEqual(self.history.query(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'logs'"), [])
+        # new runs follow the migrated ones
+        self.assertEqual(self._start_run(), 8)
+
+    def test_recorder_batches(self):
+        '''File operations are written in batches and the rest on flush'''
+        run_id = self._start_run()
+        recorder = FileOperationsRecorder(self.history, run_id, batch_size=2)
+        for name in ("a", "b", "c"):
+            recorder("copy", "/target", "Alpy/Project", f"Alpy/Project/{name}.jpg", 10, 0.5)
+        count = "SELECT COUNT(*) AS count FROM file_operations"
+        self.assertEqual(self.history.query(count)[0]["count"], 2)
+        recorder.flush()
+        self.assertEqual(self.history.query(count)[0]["count"], 3)
+        self.assertEqual(recorder.operations, [])
+
+    def test_connections_pooled(self):
+        '''Idle connections are reused by other threads, the pool keeps at most pool_size of them'''
+        history = RunHistory(self.db_path, pool_size=1)
+        with history.connection() as con:
+            pass
+        lent = []
+        def lend():
+            with history.connection() as con:
+                lent.append(con)
+        thread = threading.Thread(target=lend)
+        thread.start()
+        thread.join()
+        self.assertIs(lent[0], con)
+
+        with history.connection() as con1, history.connection() as con2:
+            self.assertIsNot(con1, con2)
+        # the connection returned to the full pool is closed
+        with self.assertRaises(sqlite3.ProgrammingError):
+            con1.execute("SELECT 1")
+        with history.connection() as con:
+            self.assertIs(con, con2)
+        history.close()
+
+    def test_failed_transaction_rolled_back(self):
+        '''A connection is returned to the pool without a pending transaction'''
+        run_id = self._start_run()
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.history.record_file_operations(run_id, [
+                ("2024/01/01 00:00:00", "copy", "/target", "Alpy/Project", "a.jpg", 10, 0.5),
+                ("2024/01/01 00:00:00", "copy", "/target", "Alpy/Project", None, 10, 0.5)])
+        self.assertEqual(self.history.query("SELECT * FROM file_operations"), [])
+        with self.history.connection() as con:
+            self.assertFalse(con.in_transaction)
+
+
+if __name__ == "__main__":
+    unittest.main()